@@ -10,7 +10,10 @@ import variancedecomposition.distributions as distributions
 import variancedecomposition.sobol as sobol
 import variancedecomposition.model as model
 import variancedecomposition.plot as plot
-import multiprocessing
+import variancedecomposition.parallel as parallel
+import variancedecomposition.store as store
+import variancedecomposition.samplestore as samplestore
+from variancedecomposition.indexarray import IndexArray
 
 import plotly.offline as pyo
 import plotly.plotly as py
@@ -25,40 +28,52 @@ import plotly.tools as pyt
 ##################
 
 
+numSamplesPerRun = 1000000
+numIdenticalRuns = 50 # Repeat the same calculation for increased accuracy
+seed = 20180101 # Root seed of the independent random streams of all tasks
+secondOrderIndices = [(0,1),(0,2),(1,2)] # E.g., (0,1) is interaction between 1st and 2nd param
+sampleDirectory = None # E.g. 'samples': draw the samples of every run once into a shared samplestore.SampleStore, used at all temperatures
+
 ## Create task to be run in parallel
-def parallelTask(T):
-    numSamplesPerRun = 1000000
-    numIdenticalRuns = 50 # Repeat the same calculation for increased accuracy
-    return [
-        sobol.testSensitivity(
-            numSamplesPerRun,
-            T,
-            distributions.distributionsCarbonBudget,
-            model.modelCarbonBudget,
-            [(0,1),(0,2),(1,2)], # Second order indices. E.g., (0,1) is interaction between 1st and 2nd param
-            False # Do not calculate third order terms
-        ) for i in range(numIdenticalRuns)
-    ]
+def parallelTask(task, rng):
+    Ti, run = task
+    samples = samplestore.SampleStore(sampleDirectory).samples(
+        numSamplesPerRun, distributions.distributionsCarbonBudget, (seed, run)
+    ) if sampleDirectory else None
+    return sobol.testSensitivity(
+        numSamplesPerRun,
+        Tvalues[Ti],
+        distributions.distributionsCarbonBudget,
+        model.modelCarbonBudget,
+        secondOrderIndices,
+        False, # Do not calculate third order terms
+        rng=rng,
+        samples=samples
+    )
 
 
 ## Define temperature values for which we want to calculate the carbon budget sensitivity
 Tvalues = np.linspace(1.0, 5, 50)
 
 
-## Calculate the sensitivity for each temperature, in parallel
-pool = multiprocessing.Pool()
-result = pool.map(parallelTask, Tvalues)
-pool.close()  
-pool.join() 
+## Draw the shared samples before the workers start, such that every
+## column is drawn only once
+if sampleDirectory:
+    for run in range(numIdenticalRuns):
+        samplestore.SampleStore(sampleDirectory).samples(numSamplesPerRun, distributions.distributionsCarbonBudget, (seed, run))
 
 
-## Process the results such that they are better readable
-processed = plot.processResults(result)
+## Calculate the sensitivity for each temperature and run, in parallel
+tasks = [(Ti, run) for Ti in range(len(Tvalues)) for run in range(numIdenticalRuns)]
+output = parallel.runTasks(parallelTask, tasks, seed=seed)
 
-# processed[0] bevat first-order relative variance voor elke parameter (kolom)
-# en voor elke temperatuur (rij)
+## All results as one (temperature, run, index term) array
+values = np.reshape([store.flattenIndices(indices) for indices in output], (len(Tvalues), numIdenticalRuns, -1))
+plan = sobol.SamplingPlan(len(distributions.distributionsCarbonBudget), secondOrderIndices, False)
+sensitivity = IndexArray.fromPlan(values, Tvalues, plan, ['TCRE', 'T2010', 'sigma_nonCO2'])
 
-# processed[1] bevat tweede orde termen
+# sensitivity.mean() bevat de relative variance van elke term (kolom),
+# gemiddeld over alle runs, voor elke temperatuur (rij)
 
 
 
@@ -69,11 +84,10 @@ processed = plot.processResults(result)
 ##################
 
 # We only look at first order variances here
-firstOrderValues = processed[0]
+firstOrders = sensitivity.select('first')
 
 # Calculate the rest (interaction terms)
-other_fill = np.maximum(0,1 - np.sum(firstOrderValues,1))
-withOther = np.concatenate([firstOrderValues, np.transpose([other_fill])], 1)
+withOther = np.concatenate([np.maximum(0, firstOrders.mean()), firstOrders.other()[:,np.newaxis]], 1)
 
 fig = plot.cumulativeAreaChart(
     xvalues=Tvalues,
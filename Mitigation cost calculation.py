@@ -10,7 +10,10 @@ import variancedecomposition.distributions as distributions
 import variancedecomposition.sobol as sobol
 import variancedecomposition.model as model
 import variancedecomposition.plot as plot
-import multiprocessing
+import variancedecomposition.parallel as parallel
+import variancedecomposition.store as store
+import variancedecomposition.profiling as profiling
+from variancedecomposition.indexarray import IndexArray
 import tqdm
 
 # import plotly.offline as pyo
@@ -18,70 +21,88 @@ import tqdm
 # import plotly.graph_objs as go
 # import plotly.tools as pyt
 
-import json_tricks
-def exportOutput(outp, name):
-    with open(name+'.json', 'w') as outfile:
-        json_tricks.dump(outp,outfile)
-
-
 ##################
 ##
 ## Calculate sensitivity indices
 ##
 ##################
 
+numSamplesPerRun = 1000000
+numIdenticalRuns = 50 # Repeat the same calculation for increased accuracy
+seed = 20180101 # Root seed of the independent random streams of all tasks
+secondOrderIndices = [(0,1),(0,2),(0,3),(1,2),(1,3),(2,3)] # E.g., (0,1) is interaction between 1st and 2nd param
+thirdOrderIndices = (0,1,2)
+totalEffects = True # Total effect indices need no extra model evaluations
+profile = False # Record the time and memory of every phase of every task
+fusedModel = False # Evaluate the costs with model.FusedModelCosts: the same values, with less memory traffic
+
+## Cost model evaluated by every task
+costModel = model.FusedModelCosts(model.CO2asfunctionofTemperature, model.f) if fusedModel else model.modelCosts
+
 ## Create task to be run in parallel
-def parallelTask(i):
-    T = Tvalues[i]
-    numSamplesPerRun = 1000000
-    numIdenticalRuns = 50 # Repeat the same calculation for increased accuracy
-    return i, [
-        sobol.testSensitivity(
-            numSamplesPerRun,
-            T,
-            distributions.distributionsCosts,
-            model.modelCosts,
-            [(0,1),(0,2),(0,3),(1,2),(1,3),(2,3)], # Second order indices. E.g., (0,1) is interaction between 1st and 2nd param
-            (0,1,2) 
-        ) for i in range(numIdenticalRuns)
-    ]
+def parallelTask(task, rng):
+    Ti, run = task
+    profiler = profiling.PhaseProfiler(Ti=Ti, run=run) if profile else None
+    indices = sobol.testSensitivity(
+        numSamplesPerRun,
+        Tvalues[Ti],
+        distributions.distributionsCosts,
+        costModel,
+        secondOrderIndices,
+        thirdOrderIndices,
+        rng=rng,
+        profiler=profiler,
+        totalEffects=totalEffects
+    )
+    return task, indices, profiler.records if profile else []
 
 
 ## Define temperature values for which we want to calculate the carbon budget sensitivity
 Tvalues = np.linspace(1.5, 5, 50)
 
+## Terms computed in every run
+plan = sobol.SamplingPlan(len(distributions.distributionsCosts), secondOrderIndices, thirdOrderIndices, totalEffects)
 
-## Calculate the sensitivity for each temperature, in parallel
-pbar = tqdm.tqdm(total=len(Tvalues))
-result = [None] * len(Tvalues)
-def update(outp):
-    i = outp[0]
-    output = outp[1]
-    result[i] = output
-    pbar.update();
-
-# pool = multiprocessing.Pool(1)
-for i in range(len(Tvalues)):
-    outp = parallelTask(i)
-    update(outp)
-    # pool.apply_async(parallelTask, (i,), callback=update)
-# pool.close()  
-# pool.join() 
 
+## Every completed (temperature, run) block is stored immediately. When the
+## script is restarted, the blocks that are already in the store are skipped
+results = store.ResultStore('relativeVariancesModel%s' % model.modelNum, dict(
+    modelNum = model.modelNum,
+    N = numSamplesPerRun,
+    seed = seed,
+    Tvalues = Tvalues,
+    numRuns = numIdenticalRuns,
+    secondOrderIndices = secondOrderIndices,
+    thirdOrderIndices = thirdOrderIndices,
+    layout = plan.layout
+))
 
+profileRecords = []
 
-exportOutput({'Tvalues': Tvalues, 'results': result}, 'relativeVariancesModelNewest%i' % model.modelNum)
+def update(outp):
+    (Ti, run), indices, records = outp
+    results.append(Ti, run, indices)
+    profileRecords.extend(records)
+    pbar.update()
 
 
-# Process the results such that they are better readable
-processed = plot.processResults(result)
+## Calculate the sensitivity for each temperature and run, in parallel
+tasks = [(Ti, run) for Ti in range(len(Tvalues)) for run in range(numIdenticalRuns)]
+done = results.completed()
+pbar = tqdm.tqdm(total=len(tasks), initial=len(done))
+parallel.runTasks(parallelTask, tasks, seed=seed, callback=update, skip=done)
+pbar.close()
 
+if profile:
+    profiling.printSummary(profileRecords)
 
-# processed[0] bevat first-order relative variance voor elke parameter (kolom)
-# en voor elke temperatuur (rij)
+## All results as one (temperature, run, index term) array
+namesOrig = ['TCRE', 'T₂₀₁₀', 'σ_nonCO₂', 'p']
+sensitivity = IndexArray.fromPlan(results.load(), Tvalues, plan, namesOrig)
 
-# processed[1] bevat tweede orde termen
-# processed[2] bevat derde orde term
+# sensitivity.mean() bevat de relative variance van elke term (kolom),
+# gemiddeld over alle runs, voor elke temperatuur (rij).
+# sensitivity.quantile([0.05, 0.95]) geeft de spreiding over de runs
 
 
 
@@ -92,25 +113,16 @@ processed = plot.processResults(result)
 ##################
 
 
-namesOrig = ['TCRE', 'T₂₀₁₀', 'σ_nonCO₂', 'p']
 desiredOrder = [0, 1, 3, 2]
-firstOrderValues = processed[0][:,desiredOrder]
-names = ['1st: '+namesOrig[i] for i in desiredOrder]
-
-labels2nd = []
-for i in range(len(namesOrig)):
-    for j in range(i+1, len(namesOrig)):
-        labels2nd += ['2nd: ' + namesOrig[i]+' ↔ '+namesOrig[j]]
-
-withSecondOrder = np.concatenate([firstOrderValues, processed[1]], 1)
-names += labels2nd
-
-withThirdOrder = np.concatenate([withSecondOrder, processed[2]], 1)
-names += ['3rd: TCRE ↔ T₂₀₁₀ ↔ σ_nonCO₂']
-
-other_fill = np.maximum(0,1 - np.sum(withThirdOrder,1))
-withOther = np.concatenate([withThirdOrder, np.transpose([other_fill])], 1)
-names += ['Other']
+firstOrders = sensitivity.select('first')
+interactions = sensitivity.select('second', 'third')
+
+withOther = np.concatenate([
+    np.maximum(0, firstOrders.mean()[:,desiredOrder]),
+    np.maximum(0, interactions.mean()),
+    sensitivity.other()[:,np.newaxis]
+], 1)
+names = [firstOrders.names[i] for i in desiredOrder] + interactions.names + ['Other']
 
 
 colors = [
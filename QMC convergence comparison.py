@@ -0,0 +1,65 @@
+###################
+##
+## Compare the convergence of plain Monte Carlo
+## and quasi-Monte Carlo sampling of the Sobol indices
+##
+###################
+
+## Import packages
+import numpy as np
+import variancedecomposition.distributions as distributions
+import variancedecomposition.sobol as sobol
+import variancedecomposition.model as model
+
+
+##################
+##
+## Settings
+##
+##################
+
+T = 2.5
+secondOrderIndices = [(0,1),(0,2),(0,3),(1,2),(1,3),(2,3)]
+numRepeats = 20 # Number of independent runs used to estimate the error
+Nvalues = [2**n for n in range(8, 17, 2)]
+samplingMethods = ['random', 'sobol', 'halton']
+
+def indices (N, sampling):
+    firstOrders, secondOrders, thirdOrders = sobol.testSensitivity(
+        N, T,
+        distributions.distributionsCosts,
+        model.modelCosts,
+        secondOrderIndices,
+        False,
+        sampling
+    )
+    return np.concatenate([firstOrders, secondOrders])
+
+
+##################
+##
+## Reference values and errors
+##
+##################
+
+np.random.seed(0)
+
+## Reference values from a large quasi-Monte Carlo run
+reference = np.mean([indices(2**20, 'sobol') for i in range(4)], 0)
+
+## Root mean squared error over all first and second order indices
+rmse = {
+    sampling: [
+        np.sqrt(np.mean([(indices(N, sampling) - reference)**2 for i in range(numRepeats)]))
+        for N in Nvalues
+    ] for sampling in samplingMethods
+}
+
+
+print('RMSE of first and second order indices at T = %.1f (%i runs each)' % (T, numRepeats))
+print('%10s' % 'N' + ''.join('%12s' % sampling for sampling in samplingMethods))
+for i, N in enumerate(Nvalues):
+    print('%10i' % N + ''.join('%12.2e' % rmse[sampling][i] for sampling in samplingMethods))
+
+## Empirical convergence rate: slope of log(RMSE) against log(N)
+print('%10s' % 'rate' + ''.join('%12.2f' % np.polyfit(np.log(Nvalues), np.log(rmse[sampling]), 1)[0] for sampling in samplingMethods))
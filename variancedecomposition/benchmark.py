@@ -0,0 +1,191 @@
+###################
+##
+## Benchmarks of the hot paths
+##
+## Times and memory-profiles the samplers, the creation of the sample
+## matrices, the model functions of every variant, the estimators and
+## the full testSensitivity, for a range of sample sizes N and numbers
+## of index terms. The results are written as JSON, such that runs on
+## different commits can be compared:
+##
+##   python -m variancedecomposition.benchmark --output before.json
+##   python -m variancedecomposition.benchmark --output after.json
+##   python -m variancedecomposition.benchmark --compare before.json after.json
+##
+###################
+
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+import scipy
+
+import variancedecomposition.distributions as distributions
+import variancedecomposition.model as model
+import variancedecomposition.sobol as sobol
+import variancedecomposition.variants as variants
+import variancedecomposition.validation as validation
+
+
+def measure (function, repeats):
+    """
+    Returns the fastest wall time of repeats calls of function, and the
+    peak memory allocated during one extra (traced) call.
+    """
+    function() # Warm-up, e.g. for cached inverse CDF tables
+    seconds = np.inf
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    peakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds, peakBytes
+
+
+def benchmarkCases (N, variantNames):
+    """
+    Yields (name, parameters, function) for every benchmark at sample size N
+    """
+    rng = np.random.default_rng(0)
+
+    ## Samplers
+    samplers = dict(
+        normal = lambda: distributions.sample_normal(N, 0.62, 0.12, rng=rng),
+        lognormal = lambda: distributions.sample_lognormal(N, np.log(distributions.pStar), distributions.pStar_sigma, rng=rng),
+        betaPERT = lambda: distributions.sample_betaPERT(N, 0.255, 0.62, 0.855, rng=rng),
+        trunclognorm = lambda: distributions.sample_trunclognorm(N, distributions.pStar, distributions.pStar_sigma, rng=rng)
+    )
+    for name, sampler in samplers.items():
+        for backend in ['exact', 'table']:
+            yield 'sample', dict(distribution=name, backend=backend), withBackend(sampler, backend)
+
+    ## Model functions of every variant
+    for variantName in variantNames:
+        variant = variants.getVariant(variantName)
+        samples = sobol.SampleMatrix([dist(N, rng=rng) for dist in variant.distributionsCosts])
+        yield 'modelCarbonBudget', dict(variant=variantName), lambda: variant.modelCarbonBudget(2.5, samples)
+        yield 'modelCosts', dict(variant=variantName), lambda: variant.modelCosts(2.5, samples)
+        if variant.f is model.f_interpolated:
+            # Only time the fused path if it still computes the same costs
+            error = validation.fusedComparison(variantName)
+            if error > 1e-12:
+                raise RuntimeError('FusedModelCosts of %s differs from modelCosts by %.1e' % (variantName, error))
+            fused = variant.fusedModelCosts()
+            yield 'fusedModelCosts', dict(variant=variantName), lambda: fused(2.5, samples)
+
+    ## Sample matrices, estimators and full runs, for an increasing
+    ## number of second order terms
+    variant = variants.getVariant(variantNames[0])
+    k = len(variant.distributionsCosts)
+    allPairs = list(itertools.combinations(range(k), 2))
+
+    for numPairs in range(0, len(allPairs) + 1, 2):
+        pairs = allPairs[:numPairs]
+        parameters = dict(variant=variant.name, numTerms=k + numPairs)
+        plan = sobol.SamplingPlan(k, pairs, False)
+
+        yield 'createSampleMatrices', parameters, lambda: sobol.createSampleMatrices(
+            N, 2.5, variant.distributionsCosts, variant.modelCosts, plan, rng=rng
+        )
+
+        outputs = sobol.createSampleMatrices(N, 2.5, variant.distributionsCosts, variant.modelCosts, plan, rng=rng)
+        yield 'estimateOrders', parameters, lambda: sobol.estimateOrders(2.5, plan, outputs)
+        del(outputs)
+
+        yield 'testSensitivity', parameters, lambda: sobol.testSensitivity(
+            N, 2.5, variant.distributionsCosts, variant.modelCosts, pairs, False, rng=rng
+        )
+
+
+def withBackend (function, backend):
+    def run ():
+        previous = distributions.samplerBackend
+        distributions.samplerBackend = backend
+        try:
+            return function()
+        finally:
+            distributions.samplerBackend = previous
+    return run
+
+
+def runBenchmarks (Nvalues, variantNames, repeats=3, log=sys.stdout):
+    results = []
+    for N in Nvalues:
+        for name, parameters, function in benchmarkCases(N, variantNames):
+            seconds, peakBytes = measure(function, repeats)
+            results.append(dict(name=name, N=N, seconds=seconds, peakBytes=peakBytes, **parameters))
+            print('%-22s N=%-9i %-55s %10.4f s %10.1f MB' % (
+                name, N, ' '.join('%s=%s' % item for item in parameters.items()), seconds, peakBytes / 1e6
+            ), file=log)
+    return results
+
+
+def metadata ():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return dict(
+        commit = commit,
+        date = datetime.datetime.now().isoformat(),
+        python = platform.python_version(),
+        numpy = np.__version__,
+        scipy = scipy.__version__,
+        machine = platform.machine(),
+        processor = platform.processor()
+    )
+
+
+def compare (before, after):
+    # Prints the ratio of the times and peak memory of two result files
+    def byKey (results):
+        return {
+            tuple(sorted((key, str(value)) for key, value in result.items() if key not in ('seconds', 'peakBytes'))): result
+            for result in results
+        }
+    old = byKey(before['results'])
+    new = byKey(after['results'])
+
+    print('Speed-up and memory ratio of %s relative to %s' % (after['meta']['commit'][:8], before['meta']['commit'][:8]))
+    for key in sorted(set(old) & set(new)):
+        description = ' '.join('%s=%s' % item for item in key)
+        print('%-90s %8.2fx %8.2fx' % (
+            description,
+            old[key]['seconds'] / new[key]['seconds'],
+            new[key]['peakBytes'] / max(1, old[key]['peakBytes'])
+        ))
+
+
+def main (arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmark the sampling, sample matrix, model and estimator hot paths')
+    parser.add_argument('--Nvalues', type=float, nargs='+', default=[1e4, 1e5, 1e6, 1e7])
+    parser.add_argument('--variants', nargs='+', default=list(variants.variants))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    arguments = parser.parse_args(arguments)
+
+    if arguments.compare:
+        with open(arguments.compare[0]) as before, open(arguments.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    results = runBenchmarks([int(N) for N in arguments.Nvalues], arguments.variants, arguments.repeats)
+
+    with open(arguments.output, 'w') as outfile:
+        json.dump(dict(meta=metadata(), results=results), outfile, indent=1)
+
+
+if __name__ == '__main__':
+    main()
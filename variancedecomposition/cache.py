@@ -0,0 +1,218 @@
+###################
+##
+## On-disk cache of sensitivity results
+##
+## Results are stored under a hash of everything they depend on:
+## the model function, the distributions and their parameters, the
+## seed, N, the temperature(s), the index sets and the other options
+## of sobol.testSensitivity. Repeating a run with the same settings
+## is then a file lookup.
+##
+## The cache directory is kept below a disk budget by removing the
+## least recently used entries. Entries are written to a temporary
+## file first and then renamed, so that pool workers sharing the same
+## directory never read a partially written entry.
+##
+###################
+
+import os
+import pickle
+import types
+import hashlib
+import tempfile
+import functools
+import numpy as np
+
+import variancedecomposition.sobol as sobol
+import variancedecomposition.distributions as distributionsModule
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows: evictions are then not serialised
+    fcntl = None
+
+
+def describe (value, seen=None):
+    """
+    Deterministic description of a value, used to compute cache keys.
+    Functions are described by their name and code, partials by their
+    function and arguments, and other objects by their class and
+    attributes.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(value, functools.partial):
+        return ('partial', describe(value.func, seen), describe(value.args, seen), describe(value.keywords, seen))
+    if hasattr(value, '__code__'):
+        # Python functions (including lambdas) are described by their code
+        # and by the module-level functions and constants they use, such
+        # that editing a function, or any function it calls, invalidates
+        # its entries
+        if value.__code__ in seen:
+            return ('function', value.__module__, value.__qualname__)
+        seen.add(value.__code__)
+        closure = [cell.cell_contents for cell in value.__closure__ or ()]
+        return (
+            'function', value.__module__, value.__qualname__,
+            describeCode(value.__code__, value.__globals__, seen),
+            describe(value.__defaults__, seen), describe(closure, seen)
+        )
+    if isinstance(value, types.CodeType):
+        return describeCode(value, {}, seen)
+    if callable(value) and hasattr(value, '__qualname__'):
+        return ('function', value.__module__, value.__qualname__)
+    if isinstance(value, dict):
+        return ('dict', sorted((str(key), describe(item, seen)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(describe(item, seen) for item in value)
+    if isinstance(value, (np.ndarray, np.generic)):
+        # Large arrays are described by a hash of their data
+        return ('array', str(value.dtype), np.shape(value), hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, type):
+        return ('type', value.__module__, value.__qualname__)
+    if hasattr(value, '__dict__'):
+        return ('object', type(value).__module__, type(value).__qualname__, describe(value.__getstate__(), seen))
+    return repr(value)
+
+
+def describeCode (code, globals, seen):
+    """
+    Bytecode and constants of a code object (including the nested code
+    objects of lambdas and comprehensions), and the globals it refers to
+    by name: functions of this package are described recursively,
+    immutable constants by their value. Attributes of modules of this
+    package (e.g. model.expfct) are followed as well. Other modules, like
+    numpy, are not part of the description.
+    """
+    used = []
+    for name in code.co_names:
+        if name not in globals:
+            continue
+        value = globals[name]
+        if isinstance(value, types.ModuleType):
+            if value.__name__.split('.')[0] != __name__.split('.')[0]:
+                continue
+            used.append((name, [
+                (attribute, describeGlobal(getattr(value, attribute), seen))
+                for attribute in code.co_names if hasattr(value, attribute)
+            ]))
+        else:
+            used.append((name, describeGlobal(value, seen)))
+
+    return (
+        'code', code.co_code.hex(),
+        tuple(describeCode(const, globals, seen) if isinstance(const, types.CodeType) else describe(const, seen) for const in code.co_consts),
+        used
+    )
+
+
+def describeGlobal (value, seen):
+    # Functions and immutable constants used by a function. Anything else,
+    # in particular mutable state such as distributions.iCDFTables (which
+    # fills up at runtime) and locks, only by its type, such that the key
+    # does not change while a program runs
+    if isinstance(value, (functools.partial, types.FunctionType)) or isConstant(value):
+        return describe(value, seen)
+    return ('global', type(value).__qualname__)
+
+
+def isConstant (value):
+    # Numbers, strings, bytes and tuples of those
+    if isinstance(value, tuple):
+        return all(isConstant(item) for item in value)
+    return value is None or isinstance(value, (int, float, complex, str, bytes, np.generic))
+
+
+# Options of testSensitivity that do not change its result
+nonSemanticOptions = ('profiler',)
+
+
+def cacheKey (*parts):
+    return hashlib.sha256(repr(describe(parts)).encode()).hexdigest()
+
+
+class EvaluationCache:
+    """
+    directory: directory of the cache files, created if necessary
+    maxBytes: disk budget. After every new entry, the least recently
+              used entries are removed until the cache fits.
+    """
+
+    def __init__ (self, directory, maxBytes=10**9):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path (self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get (self, key):
+        # Returns None if the key is not in the cache
+        try:
+            with open(self.path(key), 'rb') as infile:
+                value = pickle.load(infile)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put (self, key, value):
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as outfile:
+            pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path(key))
+
+        self.evict()
+
+    def evict (self):
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.pkl'):
+                    continue
+                try:
+                    info = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, name))
+
+            # Remove the least recently used entries first
+            totalBytes = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if totalBytes <= self.maxBytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                totalBytes -= size
+
+    def sensitivity (self, N, T, distributions, model, secondOrderIndices, thirdOrderIndices, seed, **options):
+        """
+        Cached version of sobol.testSensitivity, with all random numbers
+        drawn from np.random.default_rng(seed). Any other keyword argument
+        of testSensitivity can be passed as well, and is part of the key
+        (except for the nonSemanticOptions, like the profiler).
+        """
+        key = cacheKey(
+            'testSensitivity', N, T, distributions, model, secondOrderIndices, thirdOrderIndices, seed,
+            {name: option for name, option in options.items() if name not in nonSemanticOptions},
+            distributionsModule.samplerBackend
+        )
+
+        result = self.get(key)
+        if result is None:
+            result = sobol.testSensitivity(
+                N, T, distributions, model, secondOrderIndices, thirdOrderIndices,
+                rng=np.random.default_rng(seed), **options
+            )
+            self.put(key, result)
+        return result
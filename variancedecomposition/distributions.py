@@ -6,12 +6,71 @@
 
 ## Import packages
 
+import threading
 import numpy as np
 import scipy.stats as stats
+import scipy.special as special
+from functools import partial
 from variancedecomposition.model import modelNum
 
 
 ######## Define the sampling functions
+##
+## Every sampler draws num values. If an array of uniformly distributed
+## numbers unif is given (e.g. a quasi-random sequence), these are
+## transformed with the inverse CDF instead of drawing new random numbers.
+##
+## Random numbers are drawn from the np.random.Generator rng, or from
+## the global numpy random state if no generator is given.
+
+def randomSource (rng):
+    return np.random if rng is None else rng
+
+
+## The inverse CDFs of the beta-PERT and truncated lognormal distributions
+## are iterative root-finding routines in scipy. With samplerBackend = 'table'
+## they are replaced by a precomputed table of the inverse CDF, evaluated
+## by linear interpolation (see tabulatedICDF). Set this before creating
+## worker processes, such that the workers inherit it.
+
+samplerBackend = 'exact'
+
+iCDFTableSize = 2**14 + 1
+
+iCDFTables = {}
+
+# Held while a table is created, such that the worker threads of
+# sobol.testSensitivityStreaming create every table only once
+iCDFTablesLock = threading.Lock()
+
+def tabulatedICDF (y, key, iCDF):
+    """
+    Evaluates the inverse CDF iCDF at the uniform values y by interpolating
+    a table of iCDFTableSize values, which is created only once for every
+    key (the name and parameters of the distribution).
+    
+    The table nodes are equally spaced in logit(y) between 1e-20 and
+    1 - 1e-20, plus the end points 0 and 1, so that the steep tails of the
+    inverse CDF are resolved as well as its centre. The maximum absolute
+    interpolation error, measured halfway between all nodes, is stored in
+    iCDFTables[key]['maxError']. For the beta-PERT and truncated lognormal
+    distributions in this file it is below 1e-6.
+    """
+    with iCDFTablesLock:
+        if key not in iCDFTables:
+            logit = np.linspace(-46, 46, iCDFTableSize)
+            nodes = special.expit(logit)
+            nodes[0], nodes[-1] = 0.0, 1.0
+            values = iCDF(nodes)
+            
+            midpoints = special.expit(0.5 * (logit[1:] + logit[:-1]))
+            maxError = np.max(np.abs(np.interp(midpoints, nodes, values) - iCDF(midpoints)))
+            
+            iCDFTables[key] = dict(nodes=nodes, values=values, maxError=maxError)
+    
+    table = iCDFTables[key]
+    return np.interp(y, table['nodes'], table['values'])
+
 
 ## Beta-PERT distribution
 
@@ -33,32 +92,43 @@ def betaPERT_iCDF (y, a, b, c):
     z = stats.beta.ppf(y, alpha, beta)
     return z * (c-a) + a
 
-def sample_betaPERT(num, a, b, c):
+def sample_betaPERT(num, a, b, c, unif=None, rng=None):
     # First draw uniformly distributed numbers between 0 and 1
-    unifsample = np.random.random(num)
+    unifsample = randomSource(rng).random(num) if unif is None else unif
     
     # Then transform these to desired distribution using inverse CDF transform
+    if samplerBackend == 'table':
+        return tabulatedICDF(unifsample, ('betaPERT', a, b, c), lambda y: betaPERT_iCDF(y, a, b, c))
     return betaPERT_iCDF(unifsample, a, b, c)
 
 
 
 ######## Normal distribution
 
-def sample_normal(num, mu, sigma):
-    return sigma * np.random.randn(num) + mu
+def sample_normal(num, mu, sigma, unif=None, rng=None):
+    if unif is None:
+        return sigma * randomSource(rng).standard_normal(num) + mu
+    return sigma * stats.norm.ppf(unif) + mu
 
-def sample_lognormal(num, mu, sigma):
-    return np.random.lognormal(mean=mu, sigma=sigma, size=num)
+def sample_lognormal(num, mu, sigma, unif=None, rng=None):
+    if unif is None:
+        return randomSource(rng).lognormal(mean=mu, sigma=sigma, size=num)
+    return np.exp(sigma * stats.norm.ppf(unif) + mu)
 
-def sample_trunclognorm(num, pStar, pStar_sigma, low=0.0, high=1.5):
+def trunclognorm_iCDF (y, pStar, pStar_sigma, low=0.0, high=1.5):
     dist = stats.lognorm(s=pStar_sigma, scale=pStar)
     
     CDF_low = dist.cdf(low)
     CDF_high = dist.cdf(high)
     
-    unifsample = (CDF_high - CDF_low) * np.random.random(num) + CDF_low
+    return dist.ppf((CDF_high - CDF_low) * y + CDF_low)
+
+def sample_trunclognorm(num, pStar, pStar_sigma, low=0.0, high=1.5, unif=None, rng=None):
+    unifsample = randomSource(rng).random(num) if unif is None else unif
     
-    return dist.ppf(unifsample)
+    if samplerBackend == 'table':
+        return tabulatedICDF(unifsample, ('trunclognorm', pStar, pStar_sigma, low, high), lambda y: trunclognorm_iCDF(y, pStar, pStar_sigma, low, high))
+    return trunclognorm_iCDF(unifsample, pStar, pStar_sigma, low, high)
 
 ######## Distribution for full mitigation cost model
 #pStar = 0.24154
@@ -67,90 +137,98 @@ pStar = 0.20615
 #pStar_sigma = 1.08
 pStar_sigma = 0.83555
 
-#distribution_p = lambda N: sample_betaPERT(N, 0, pStar, 1)
-#distribution_p = lambda N: sample_lognormal(N, np.log(pStar), pStar_sigma)
-distribution_p = lambda N: sample_trunclognorm(N, pStar, pStar_sigma, high=1.5)
+#distribution_p = partial(sample_betaPERT, a=0, b=pStar, c=1)
+#distribution_p = partial(sample_lognormal, mu=np.log(pStar), sigma=pStar_sigma)
+distribution_p = partial(sample_trunclognorm, pStar=pStar, pStar_sigma=pStar_sigma, high=1.5)
 
 sigma_nonCO2_std = 0.121
 
-if modelNum == 0:
+## All variants, by modelNum (see model.py)
+
+distributionsCostsPerModel = {}
+
 # TCRE from pink plume, symmetrical distribution (Gaussian)
 
-    distributionsCosts = [
-        lambda N: sample_normal(N, 0.62, 0.12), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std),  # sigma_nonCO2
-        distribution_p   # p
-    ]
+distributionsCostsPerModel[0] = [
+    partial(sample_normal, mu=0.62, sigma=0.12), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std),  # sigma_nonCO2
+    distribution_p   # p
+]
 
-elif modelNum == 1:
 # TCRE from pink plume, asymmetrical distribution (beta-PERT)
 
-    distributionsCosts = [
-        lambda N: sample_betaPERT(N, 0.255, 0.62, 0.855), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std),  # sigma_nonCO2
-        distribution_p   # p
-    ]
+distributionsCostsPerModel[1] = [
+    partial(sample_betaPERT, a=0.255, b=0.62, c=0.855), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std),  # sigma_nonCO2
+    distribution_p   # p
+]
 
-elif modelNum == 2:
 # TCRE from gray plume , linear non-CO2
 
-    distributionsCosts = [
-        lambda N: sample_normal(N, 0.45, 0.12), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std),  # sigma_nonCO2
-        distribution_p   # p
-    ]
+distributionsCostsPerModel[2] = [
+    partial(sample_normal, mu=0.45, sigma=0.12), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std),  # sigma_nonCO2
+    distribution_p   # p
+]
 
-elif modelNum == 3:
 # TCRE from gray plume , convex non-CO2
 
-    distributionsCosts = [
-        lambda N: sample_normal(N, 0.45, 0.12), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std / 0.60713),  # sigma_nonCO2 
-                    # is different from others, since it is still multiplied
-                    # by forcingToTemperature term
-        distribution_p   # p
-    ]
+distributionsCostsPerModel[3] = [
+    partial(sample_normal, mu=0.45, sigma=0.12), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std / 0.60713),  # sigma_nonCO2 
+                # is different from others, since it is still multiplied
+                # by forcingToTemperature term
+    distribution_p   # p
+]
 
-elif modelNum == 3.1:
 # TCRE from gray plume , convex non-CO2
 
-    distributionsCosts = [
-        lambda N: sample_normal(N, 0.45, 0.12), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std / 0.60713 / 2),  # sigma_nonCO2 
-                    # is different from others, since it is still multiplied
-                    # by forcingToTemperature term
-                    # However, to obtain pink plume, twice the MAGICC coefficient is used
-                    # This leads to an overestimation of 2 of the uncertainty. This is dealt
-                    # with here.
-        distribution_p   # p
-    ]
-
-elif modelNum == 4:
+distributionsCostsPerModel[3.1] = [
+    partial(sample_normal, mu=0.45, sigma=0.12), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std / 0.60713 / 2),  # sigma_nonCO2 
+                # is different from others, since it is still multiplied
+                # by forcingToTemperature term
+                # However, to obtain pink plume, twice the MAGICC coefficient is used
+                # This leads to an overestimation of 2 of the uncertainty. This is dealt
+                # with here.
+    distribution_p   # p
+]
+
 # TCRE from Collins et al (2013) , linear non-CO2
 
-    distributionsCosts = [
-        lambda N: sample_normal(N, 0.45, 0.25), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std),  # sigma_nonCO2
-        distribution_p   # p
-    ]
+distributionsCostsPerModel[4] = [
+    partial(sample_normal, mu=0.45, sigma=0.25), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std),  # sigma_nonCO2
+    distribution_p   # p
+]
+
+# TCRE from pink plume, asymmetrical distribution (beta-PERT), log-linear costs
+# with a normally distributed error in the log of the costs
+
+sigma_logprice = 0.85114
+
+distribution_logprice = partial(sample_normal, mu=0, sigma=sigma_logprice)
+
+distributionsCostsPerModel[5] = [
+    partial(sample_betaPERT, a=0.255, b=0.62, c=0.855), # TCRE
+    partial(sample_normal, mu=0.909, sigma=0.15/2), # T2010
+    partial(sample_normal, mu=0, sigma=sigma_nonCO2_std),  # sigma_nonCO2
+    distribution_logprice   # eps
+]
+
 
-elif modelNum == 5:
-	sigma_logprice = 0.85114
+## Variant selected by modelNum
 
-	distribution_p = lambda N: sample_normal(N, 0, sigma_logprice)
+distributionsCosts = distributionsCostsPerModel[modelNum]
 
-	distributionsCosts = [
-        lambda N: sample_betaPERT(N, 0.255, 0.62, 0.855), # TCRE
-        lambda N: sample_normal(N, 0.909, 0.15/2), # T2010
-        lambda N: sample_normal(N, 0, sigma_nonCO2_std),  # sigma_nonCO2
-        distribution_p   # p
-    ]
+if modelNum == 5:
+    distribution_p = distribution_logprice
 
 ######## Distribution for carbon budget model
 
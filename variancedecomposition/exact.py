@@ -0,0 +1,388 @@
+###################
+##
+## Exact Sobol indices of the linear carbon budget models
+##
+## For the variants with carbon budget
+##   CO2 = (T - T2010 - sigma_nonCO2) / max(0.001, TCRE + offset)
+## (pink plume and linear non-CO2, models 0, 1, 2 and 4) all Sobol
+## indices follow from low-dimensional integrals instead of sampling:
+##
+## - Carbon budget: CO2 = X W, with X = T - T2010 - sigma_nonCO2 normal
+##   and W = 1 / max(0.001, TCRE + offset) independent of X. The closed
+##   variances follow from the mean and variance of X and from E[W]
+##   and E[W^2].
+## - Costs: f_interpolated is linear in p, cost = g0(CO2) + g1(CO2) p.
+##   The closed variances follow from the second moments of the
+##   conditional expectations of g0 and g1 given subsets of (TCRE,
+##   T2010, sigma_nonCO2). Given TCRE, CO2 is normal, and g0 and g1
+##   (see model.expfct) are sums of exponentials between the kinks, so
+##   the expectations over the normal parameters are closed form. What
+##   remains are 1-D Gauss quadratures over TCRE and 2-D ones over TCRE
+##   and T2010 (or sigma_nonCO2), or over TCRE and X.
+##
+## The integrands have kinks where CO2 = -3 or 5.5 (see f_interpolated)
+## and where TCRE + offset = 0.001. Every quadrature is split at these
+## kinks, such that it converges exponentially: the carbon budget
+## indices are exact to machine precision in about 2 ms, the cost
+## indices to about 1e-9 (mostly 1e-12 or better) in 20 to 90 ms per
+## temperature with the default quadrature sizes. The largest arrays
+## have numHermite x (number of TCRE nodes) elements, where the number
+## of TCRE nodes is about numNodes x (numPanels + 17) for beta-PERT
+## distributions: some 12 MB with the defaults, and about 120 MB with
+## numPanels=64, numNodes=48 and numHermite=96. The indices then follow
+## from the closed variances as in sobol.combineOrders, and serve as an
+## oracle for the Monte Carlo estimators (see validation.py).
+##
+###################
+
+import itertools
+import numpy as np
+import scipy.stats as stats
+import scipy.special as special
+
+import variancedecomposition.model as model
+import variancedecomposition.distributions as distributions
+import variancedecomposition.sobol as sobol
+
+
+# Kinks of the cost function f_interpolated in CO2: CO2 is clipped
+# at -3, and the costs are zero above 5.5
+costKinks = np.array([-3.0, 5.5])
+
+# Smallest denominator of the carbon budget
+minDenominator = 0.001
+
+# Gaussian integrals are truncated at this many standard deviations
+gaussianRange = 9.0
+
+
+def describeDistribution (distribution):
+    # Name and parameters of one of the samplers in distributions.py
+    samplers = {
+        distributions.sample_normal: 'normal',
+        distributions.sample_lognormal: 'lognormal',
+        distributions.sample_betaPERT: 'betaPERT',
+        distributions.sample_trunclognorm: 'trunclognorm'
+    }
+    if getattr(distribution, 'func', None) not in samplers:
+        raise ValueError('Unknown distribution: %r' % (distribution,))
+    return samplers[distribution.func], distribution.keywords
+
+
+def moments (distribution):
+    # Mean and second moment of a distribution
+    name, parameters = describeDistribution(distribution)
+
+    if name == 'normal':
+        mu, sigma = parameters['mu'], parameters['sigma']
+        return mu, mu**2 + sigma**2
+
+    if name == 'lognormal':
+        frozen = stats.lognorm(s=parameters['sigma'], scale=np.exp(parameters['mu']))
+    elif name == 'betaPERT':
+        frozen = betaPERT(**parameters)
+    else:
+        # E[p^k] of the lognormal distribution truncated to [low, high]
+        mu, sigma = np.log(parameters['pStar']), parameters['pStar_sigma']
+        low, high = parameters.get('low', 0.0), parameters.get('high', 1.5)
+        with np.errstate(divide='ignore'):
+            bounds = (np.log([low, high]) - mu) / sigma
+        mass = np.diff(stats.norm.cdf(bounds))[0]
+        return tuple(
+            np.exp(k*mu + 0.5 * k**2 * sigma**2) * np.diff(stats.norm.cdf(bounds - k*sigma))[0] / mass
+            for k in (1, 2)
+        )
+
+    return frozen.mean(), frozen.moment(2)
+
+
+def betaPERT (a, b, c):
+    # Beta-PERT distribution as scipy distribution (see distributions.betaPERT_PDF)
+    alpha = (4*b+c-5*a)/(c-a)
+    beta = (5*c-a-4*b)/(c-a)
+    return stats.beta(alpha, beta, loc=a, scale=c-a)
+
+
+def legendrePieces (lo, hi, breakpoints, numNodes):
+    """
+    Gauss-Legendre nodes and weights on [lo, hi], with numNodes nodes on
+    every piece between consecutive breakpoints. Breakpoints outside
+    [lo, hi] give empty pieces, with zero weights.
+
+    breakpoints has shape (..., number of breakpoints). The nodes and
+    weights have shape (..., (number of breakpoints + 1) * numNodes).
+    """
+    breakpoints = np.asarray(breakpoints, dtype=np.float64)
+    lo = np.broadcast_to(lo, breakpoints.shape[:-1] + (1,))
+    hi = np.broadcast_to(hi, breakpoints.shape[:-1] + (1,))
+
+    points = np.sort(np.clip(np.concatenate([lo, breakpoints, hi], -1), lo, hi), -1)
+    centres = 0.5 * (points[..., 1:] + points[..., :-1])[..., np.newaxis]
+    halfWidths = 0.5 * (points[..., 1:] - points[..., :-1])[..., np.newaxis]
+
+    x, w = np.polynomial.legendre.leggauss(numNodes)
+    shape = breakpoints.shape[:-1] + (-1,)
+    return np.reshape(centres + halfWidths * x, shape), np.reshape(halfWidths * w, shape)
+
+
+def gaussianRule (kinks, numPanels=6, numNodes=16):
+    # Nodes and weights in z for expectations over a standard normal z, on
+    # numPanels equal panels that are also split at the kinks
+    kinks = np.asarray(kinks, dtype=np.float64)
+    panels = np.broadcast_to(np.linspace(-gaussianRange, gaussianRange, numPanels + 1)[1:-1], kinks.shape[:-1] + (numPanels - 1,))
+    z, weights = legendrePieces(-gaussianRange, gaussianRange, np.concatenate([panels, kinks], -1), numNodes)
+    return z, weights * np.exp(-0.5 * z**2) / np.sqrt(2 * np.pi)
+
+
+def reciprocalRule (distribution, offset, kinks=np.zeros(0), numPanels=16, numNodes=16):
+    """
+    Nodes and weights for expectations over W = 1 / max(0.001, TCRE + offset),
+    with TCRE normal or beta-PERT distributed. The quadrature runs over
+    y = log(TCRE + offset), in which the integrands are smooth, on
+    numPanels equal panels that are also split at the given kinks (values
+    of W, shape (..., number of kinks)). The last node is W = 1000, with
+    the probability that TCRE + offset is below 0.001.
+
+    Returns the nodes W and the weights, of shape (..., number of nodes).
+    """
+    name, parameters = describeDistribution(distribution)
+    if name == 'normal':
+        frozen = stats.norm(parameters['mu'], parameters['sigma'])
+        low, high = frozen.ppf([1e-300, 1 - 1e-16])
+        grading = []
+    elif name == 'betaPERT':
+        frozen = betaPERT(**parameters)
+        low, high = parameters['a'], parameters['c']
+        # The density is not smooth at the end points of its support:
+        # panels are refined geometrically towards both ends
+        steps = (high - low) * 0.25**np.arange(1, 9)
+        grading = np.log(np.concatenate([low + steps, high - steps]) + offset)
+    else:
+        raise ValueError('No quadrature for a %s distributed TCRE' % name)
+
+    kinks = np.asarray(kinks, dtype=np.float64)
+    yLow = np.log(max(minDenominator, low + offset))
+    yHigh = np.log(high + offset)
+
+    panels = np.concatenate([np.linspace(yLow, yHigh, numPanels + 1)[1:-1], grading])
+    panels = np.broadcast_to(panels, kinks.shape[:-1] + panels.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kinks = np.where(kinks > 0, -np.log(np.abs(kinks)), yLow)
+
+    y, weights = legendrePieces(yLow, yHigh, np.concatenate([panels, kinks], -1), numNodes)
+    weights = weights * frozen.pdf(np.exp(y) - offset) * np.exp(y)
+
+    # Probability mass of the cut-off at 0.001
+    atom = frozen.cdf(minDenominator - offset)
+    W = np.concatenate([np.exp(-y), np.full(y.shape[:-1] + (1,), 1 / minDenominator)], -1)
+    weights = np.concatenate([weights, np.full(y.shape[:-1] + (1,), atom)], -1)
+
+    return W, weights
+
+
+def linearModel (variant):
+    """
+    Offset of TCRE in the carbon budget of variant, and the distributions
+    of its parameters. Raises a ValueError for variants that are not
+    covered by the exact engine.
+    """
+    if variant.CO2asfunctionofTemperature is model.CO2asfunctionofTemperature_pinkPlume:
+        offset = 0.0
+    elif variant.CO2asfunctionofTemperature is model.CO2asfunctionofTemperature_linearNonCO2:
+        offset = model.TCRE_nonCO2
+    else:
+        raise ValueError('No exact indices for the nonlinear carbon budget of %r' % variant)
+
+    for distribution in variant.distributionsCosts[1:3]:
+        if describeDistribution(distribution)[0] != 'normal':
+            raise ValueError('No exact indices for %r: T2010 and sigma_nonCO2 must be normal' % variant)
+
+    return offset, variant.distributionsCosts
+
+
+def allSubsets (k):
+    return [frozenset(subset) for size in range(k + 1) for subset in itertools.combinations(range(k), size)]
+
+
+def carbonBudgetClosedVariances (T, variant, numPanels=16, numNodes=16):
+    # Relative closed variance of every subset of (TCRE, T2010, sigma_nonCO2)
+    offset, parameters = linearModel(variant)
+
+    W, weights = reciprocalRule(parameters[0], offset, numPanels=numPanels, numNodes=numNodes)
+    meanW = np.sum(weights * W)
+    secondW = np.sum(weights * W**2)
+
+    # X = T - T2010 - sigma_nonCO2
+    meanX = T - parameters[1].keywords['mu'] - parameters[2].keywords['mu']
+    variances = {1: parameters[1].keywords['sigma']**2, 2: parameters[2].keywords['sigma']**2}
+
+    # E[CO2 | S] = E[X | S] E[W | S]
+    closed = {
+        subset: (meanX**2 + sum(variances.get(i, 0) for i in subset)) * (secondW if 0 in subset else meanW**2) - meanX**2 * meanW**2
+        for subset in allSubsets(3)
+    }
+    total = closed[frozenset(range(3))]
+    return {subset: value / total for subset, value in closed.items()}
+
+
+def costParts (CO2):
+    # f_interpolated(CO2, p) = g0 + g1 p
+    safe_CO2 = np.maximum(-3, CO2)
+    g0 = model.fMin(safe_CO2)
+    return np.stack([g0, model.fMax(safe_CO2) - g0])
+
+
+def expfctTerms (a, b):
+    """
+    model.expfct(max(-3, CO2), a, b) as a sum of exponentials
+    coefficient * exp(-rate * CO2) on each of the pieces between the
+    costKinks: (-inf, -3), [-3, 5.5) and [5.5, inf).
+    """
+    cutoff = a * np.exp(-costKinks[1] * b)
+    return [[(a * np.exp(-costKinks[0] * b) - cutoff, 0.0)], [(a, b), (-cutoff, 0.0)], []]
+
+
+def costTerms ():
+    # g0 and g1 of costParts, and the products g0 g0, g0 g1 and g1 g1, as
+    # sums of exponentials on every piece (see expfctTerms)
+    g0 = expfctTerms(*model.fMinParams)
+    gMax = expfctTerms(*model.fMaxParams)
+    g1 = [termsMax + [(-coefficient, rate) for coefficient, rate in terms0] for termsMax, terms0 in zip(gMax, g0)]
+
+    def product (f, g):
+        return [[(cf * cg, rf + rg) for cf, rf in termsF for cg, rg in termsG] for termsF, termsG in zip(f, g)]
+
+    return [g0, g1], [product(g0, g0), product(g0, g1), product(g1, g1)]
+
+
+def logNormalMass (a, b):
+    # log(Phi(b) - Phi(a)) for a <= b, accurate in both tails
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        upper = a > 0
+        logA = special.log_ndtr(np.where(upper, -a, a))
+        logB = special.log_ndtr(np.where(upper, -b, b))
+        return np.where(
+            upper,
+            logA + np.log1p(-np.exp(logB - logA)),
+            logB + np.log1p(-np.exp(logA - logB))
+        )
+
+
+def gaussianTermExpectation (parts, mean, std):
+    """
+    E[g(C)] for C ~ N(mean, std^2), for every function g in parts given as
+    sums of exponentials per piece (see costTerms), in closed form:
+    E[exp(-r C); l < C < u] = exp(-r mean + r^2 std^2 / 2) (Phi(b) - Phi(a))
+    with a, b = (l - mean) / std + r std and (u - mean) / std + r std.
+    The exponent and the normal mass are combined in log space, such
+    that neither overflows for large std (TCRE close to zero).
+    """
+    mean, std = np.broadcast_arrays(np.asarray(mean, dtype=np.float64), np.asarray(std, dtype=np.float64))
+    bounds = np.concatenate([[-np.inf], costKinks, [np.inf]])
+
+    # The parts share most (piece, rate) combinations: every expectation
+    # is computed only once
+    expectations = {}
+    def expectation (piece, rate):
+        if (piece, rate) not in expectations:
+            shift = rate * std
+            logMass = logNormalMass((bounds[piece] - mean) / std + shift, (bounds[piece + 1] - mean) / std + shift)
+            expectations[piece, rate] = np.exp(-rate * mean + 0.5 * shift**2 + logMass)
+        return expectations[piece, rate]
+
+    return np.stack([
+        sum((coefficient * expectation(piece, rate) for piece, terms in enumerate(pieces) for coefficient, rate in terms), np.zeros(mean.shape))
+        for pieces in parts
+    ])
+
+
+def secondMoments (parts, weights):
+    # E[h_a h_b] for (a, b) = 00, 01, 11 of conditional expectations h
+    # at quadrature nodes with the given weights
+    return np.array([np.sum(parts[a] * parts[b] * weights) for a, b in ((0, 0), (0, 1), (1, 1))])
+
+
+def costClosedVariances (T, variant, numPanels=16, numNodes=24, numHermite=48):
+    """
+    Relative closed variance of every subset of (TCRE, T2010, sigma_nonCO2, p)
+    for the costs f_interpolated(CO2, p) = g0(CO2) + g1(CO2) p.
+    """
+    if variant.f is not model.f_interpolated:
+        raise ValueError('No exact indices for the cost function of %r' % variant)
+
+    offset, parameters = linearModel(variant)
+    mean0, std0 = parameters[1].keywords['mu'], parameters[1].keywords['sigma']
+    meanS, stdS = parameters[2].keywords['mu'], parameters[2].keywords['sigma']
+    meanP, secondP = moments(parameters[3])
+
+    # X = T - T2010 - sigma_nonCO2 and CO2 = X W. Given W, CO2 is normal,
+    # so expectations over X (or over one of T2010 and sigma_nonCO2) of
+    # g0, g1 and their products are closed form
+    meanX = T - mean0 - meanS
+    stdX = np.hypot(std0, stdS)
+    parts, products = costTerms()
+
+    W, weightsW = reciprocalRule(parameters[0], offset, numPanels=numPanels, numNodes=numNodes)
+
+    # Second moments of E[g | S], for every subset S of the first three parameters
+    M = {}
+
+    # Given TCRE, and given all three: 1-D quadratures over W
+    HX = gaussianTermExpectation(parts, meanX * W, stdX * W)
+    means = HX @ weightsW
+    M[frozenset()] = np.array([means[0]**2, means[0] * means[1], means[1]**2])
+    M[frozenset((0,))] = secondMoments(HX, weightsW)
+    M[frozenset((0, 1, 2))] = gaussianTermExpectation(products, meanX * W, stdX * W) @ weightsW
+
+    # Given T2010 (or sigma_nonCO2), with and without TCRE: X given
+    # T2010 is normal with the spread of sigma_nonCO2 only, and vice versa.
+    # 2-D quadratures over the given parameter and W
+    z, weightsZ = np.polynomial.hermite_e.hermegauss(numHermite)
+    weightsZ = weightsZ / np.sqrt(2 * np.pi)
+    for i, stdGiven, stdOther in ((1, std0, stdS), (2, stdS, std0)):
+        H = gaussianTermExpectation(parts, (meanX - stdGiven * z)[:, np.newaxis] * W, stdOther * W)
+        M[frozenset((i,))] = secondMoments(H @ weightsW, weightsZ)
+        M[frozenset((0, i))] = secondMoments(H, weightsZ[:, np.newaxis] * weightsW)
+
+    # Given X (T2010 and sigma_nonCO2): integrate over TCRE for every X,
+    # split where X W reaches a kink. E[g | X] has kinks itself where
+    # X / 0.001 does. 2-D quadrature over X and W
+    zX, weightsX = gaussianRule((costKinks * minDenominator - meanX) / stdX, numNodes=numNodes)
+    x = meanX + stdX * zX
+    with np.errstate(divide='ignore'):
+        WX, weightsWX = reciprocalRule(parameters[0], offset, costKinks / x[:, np.newaxis], numPanels, numNodes)
+    hX = np.sum(costParts(x[:, np.newaxis] * WX) * weightsWX, -1)
+    M[frozenset((1, 2))] = secondMoments(hX, weightsX)
+
+    # Cost = g0 + g1 p, with p independent: E[cost | S] is
+    # E[g0 | S] + E[g1 | S] p if p is in S, else E[g0 | S] + E[g1 | S] E[p]
+    meanCost = means[0] + meanP * means[1]
+    closed = {}
+    for subset in allSubsets(4):
+        M00, M01, M11 = M[subset - {3}]
+        closed[subset] = M00 + 2 * meanP * M01 + (secondP if 3 in subset else meanP**2) * M11 - meanCost**2
+
+    total = closed[frozenset(range(4))]
+    return {subset: value / total for subset, value in closed.items()}
+
+
+def exactSensitivity (T, variant, secondOrderIndices, thirdOrderIndices, totalEffects=False, costs=True, **options):
+    """
+    Exact first, second and third order indices (and total effects) of the
+    costs of variant (a variants.ModelVariant), or of its carbon budget if
+    costs is False. The result has the same layout as sobol.testSensitivity,
+    also in grid mode when T is an array.
+
+    options: numPanels and numNodes (and numHermite for the costs) set the
+             size of the quadratures
+    """
+    k = 4 if costs else 3
+    plan = sobol.SamplingPlan(k, secondOrderIndices, thirdOrderIndices, totalEffects)
+    closedVariances = costClosedVariances if costs else carbonBudgetClosedVariances
+
+    values = [closedVariances(temperature, variant, **options) for temperature in np.ravel(T)]
+    closed = [np.array([value[subset] for value in values]) for subset in plan.closedSets]
+    if np.ndim(T) == 0:
+        closed = [value[0] for value in closed]
+
+    return sobol.combineOrders(T, plan, closed)
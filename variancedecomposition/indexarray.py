@@ -0,0 +1,98 @@
+###################
+##
+## Labelled array of sensitivity results
+##
+## All index values of a sweep are held in one array of shape
+## (number of temperatures, number of runs, number of index terms),
+## together with the temperatures, the order and parameters of every
+## term and the parameter names. Averages over the runs, quantiles and
+## the remainder not explained by the computed terms are then single
+## numpy reductions.
+##
+###################
+
+import numpy as np
+
+
+orderNames = ['first', 'second', 'third', 'total']
+orderLabels = dict(first='1st', second='2nd', third='3rd', total='Total')
+
+
+class IndexArray:
+    """
+    values: array of shape (len(Tvalues), number of runs, number of terms).
+            Missing values (e.g. blocks of a sweep that were not computed
+            yet) are NaN, and are ignored by all reductions.
+    Tvalues: temperature of every row
+    orders: order of every term: 'first', 'second', 'third' or 'total'
+    terms: tuple of parameter numbers of every term
+    parameterNames: optional names of the parameters, used for the labels
+    """
+
+    def __init__ (self, values, Tvalues, orders, terms, parameterNames=None):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.Tvalues = np.asarray(Tvalues)
+        self.orders = np.asarray(orders)
+        self.terms = list(terms)
+        self.parameterNames = parameterNames
+
+        if self.values.shape[-1] != len(self.terms):
+            raise ValueError('Expected %i index terms, got %i' % (len(self.terms), self.values.shape[-1]))
+
+    @classmethod
+    def fromPlan (cls, values, Tvalues, plan, parameterNames=None):
+        # Labels of the terms computed with a sobol.SamplingPlan, in the
+        # order of store.flattenIndices
+        orders = (
+            ['first'] * plan.k + ['second'] * len(plan.secondOrder) + ['third'] * len(plan.thirdOrder)
+            + (['total'] * plan.k if plan.totalEffects else [])
+        )
+        terms = plan.terms + ([(i,) for i in range(plan.k)] if plan.totalEffects else [])
+        return cls(values, Tvalues, orders, terms, parameterNames)
+
+    @classmethod
+    def fromNested (cls, results, Tvalues=None):
+        """
+        Converts nested lists results[Ti][run] of testSensitivity outputs.
+        The parameters of the terms are not known, so only the orders are
+        labelled.
+        """
+        values = np.array([
+            [np.concatenate([np.ravel(orders) for orders in indices]) for indices in runs]
+            for runs in results
+        ])
+        layout = [np.size(orders) for orders in results[0][0]]
+        orders = np.repeat(orderNames[:len(layout)], layout)
+        terms = [()] * len(orders)
+        return cls(values, np.arange(len(values)) if Tvalues is None else Tvalues, orders, terms)
+
+    @property
+    def names (self):
+        # E.g. '1st: TCRE' or '2nd: TCRE ↔ T2010'
+        parameterNames = self.parameterNames or ['p%i' % i for i in range(1 + max(max(term, default=0) for term in self.terms))]
+        return [
+            orderLabels[order] + ': ' + ' ↔ '.join(parameterNames[i] for i in term)
+            for order, term in zip(self.orders, self.terms)
+        ]
+
+    def select (self, *orders):
+        # The terms of the given orders only
+        mask = np.isin(self.orders, orders)
+        return IndexArray(
+            self.values[..., mask], self.Tvalues, self.orders[mask],
+            [term for term, selected in zip(self.terms, mask) if selected], self.parameterNames
+        )
+
+    def mean (self):
+        # Average over the runs: array of shape (number of temperatures, number of terms)
+        return np.nanmean(self.values, 1)
+
+    def quantile (self, q):
+        # Quantile(s) q over the runs, with the axes of q in front
+        return np.nanquantile(self.values, q, axis=1)
+
+    def other (self):
+        # Variance fraction not explained by the (non-negative) mean first,
+        # second and third order terms, per temperature
+        explained = np.sum(np.maximum(0, self.select('first', 'second', 'third').mean()), -1)
+        return np.maximum(0, 1 - explained)
@@ -7,6 +7,7 @@
 ##
 ###################
 
+import math
 import numpy as np
 
 
@@ -18,6 +19,10 @@ import numpy as np
 ## 3: TCRE from gray plume + convex non-CO2 contributions (#4 in paper)
 ## 4: TCRE from Collins et al (2013) + linear non-CO2 contributions (#5 in paper)
 ## 5: TCRE from pink plume, log-linear cost distribution (#XX in paper)
+##
+## modelNum selects the default variant used by the functions below.
+## All variants are also available by name, at the same time, through
+## the registry in variancedecomposition/variants.py
 
 modelNum = 0
 
@@ -28,40 +33,55 @@ modelNum = 0
 
 
 ## Carbon budget
+##
+## All variants are defined here, the module-level switch modelNum only
+## selects which of them is used as CO2asfunctionofTemperature and
+## TemperatureasfunctionofCO2. To use several variants in the same
+## process, use the registry in variancedecomposition/variants.py.
 
-if modelNum in [0, 1, 5]:
 # TCRE from pink plume
 
-    def CO2asfunctionofTemperature (T, TCRE, T0, sigma_nonCO2):
-        return (T - T0 - sigma_nonCO2) / np.maximum(0.001, TCRE)
+def CO2asfunctionofTemperature_pinkPlume (T, TCRE, T0, sigma_nonCO2):
+    return (T - T0 - sigma_nonCO2) / np.maximum(0.001, TCRE)
 
-    def TemperatureasfunctionofCO2 (CO2, TCRE, T0, sigma_nonCO2):
-        return T0 + TCRE * CO2 + sigma_nonCO2
+def TemperatureasfunctionofCO2_pinkPlume (CO2, TCRE, T0, sigma_nonCO2):
+    return T0 + TCRE * CO2 + sigma_nonCO2
 
-elif modelNum in [2, 4]:
 # TCRE from gray plume or from Collins + linear non-CO2
 
-    TCRE_nonCO2 = 0.17
-    
-    def CO2asfunctionofTemperature (T, TCRE_CO2, T0, sigma_nonCO2):
-        return (T - T0 - sigma_nonCO2) / np.maximum(0.001, TCRE_CO2 + TCRE_nonCO2)
-    
-    def TemperatureasfunctionofCO2 (CO2, TCRE_CO2, T0, sigma_nonCO2):
-        return T0 + (TCRE_CO2 + TCRE_nonCO2) * CO2 + sigma_nonCO2
-    
-elif modelNum in [3, 3.1]:
+TCRE_nonCO2 = 0.17
+
+def CO2asfunctionofTemperature_linearNonCO2 (T, TCRE_CO2, T0, sigma_nonCO2):
+    return (T - T0 - sigma_nonCO2) / np.maximum(0.001, TCRE_CO2 + TCRE_nonCO2)
+
+def TemperatureasfunctionofCO2_linearNonCO2 (CO2, TCRE_CO2, T0, sigma_nonCO2):
+    return T0 + (TCRE_CO2 + TCRE_nonCO2) * CO2 + sigma_nonCO2
+
 # TCRE from gray plume + convex non-CO2:
+
+forcingToTemp = 2 * 0.60126 # Twice the MAGICC coefficient
+b = 0.11456985
+c = 0.00771118
+
+def CO2asfunctionofTemperature_convexNonCO2 (T, TCRE_CO2, T0, sigma_nonCO2):
+    inSqrt = np.maximum(0.0, -4*c*forcingToTemp*(forcingToTemp*sigma_nonCO2 - T + T0) + (b*forcingToTemp + TCRE_CO2)**2)
+    return -(1.0/(2*c*forcingToTemp))*(b*forcingToTemp + TCRE_CO2 - np.sqrt(inSqrt))
+
+def TemperatureasfunctionofCO2_convexNonCO2 (CO2, TCRE_CO2, T0, sigma_nonCO2):
+    return T0 + TCRE_CO2 * CO2 + forcingToTemp * (b * CO2 + c * CO2**2 + sigma_nonCO2)
+
+
+if modelNum in [0, 1, 5]:
+    CO2asfunctionofTemperature = CO2asfunctionofTemperature_pinkPlume
+    TemperatureasfunctionofCO2 = TemperatureasfunctionofCO2_pinkPlume
+
+elif modelNum in [2, 4]:
+    CO2asfunctionofTemperature = CO2asfunctionofTemperature_linearNonCO2
+    TemperatureasfunctionofCO2 = TemperatureasfunctionofCO2_linearNonCO2
     
-    forcingToTemp = 2 * 0.60126 # Twice the MAGICC coefficient
-    b = 0.11456985
-    c = 0.00771118
-    
-    def CO2asfunctionofTemperature (T, TCRE_CO2, T0, sigma_nonCO2):
-        inSqrt = np.maximum(0.0, -4*c*forcingToTemp*(forcingToTemp*sigma_nonCO2 - T + T0) + (b*forcingToTemp + TCRE_CO2)**2)
-        return -(1.0/(2*c*forcingToTemp))*(b*forcingToTemp + TCRE_CO2 - np.sqrt(inSqrt))
-    
-    def TemperatureasfunctionofCO2 (CO2, TCRE_CO2, T0, sigma_nonCO2):
-        return T0 + TCRE_CO2 * CO2 + forcingToTemp * (b * CO2 + c * CO2**2 + sigma_nonCO2)
+elif modelNum in [3, 3.1]:
+    CO2asfunctionofTemperature = CO2asfunctionofTemperature_convexNonCO2
+    TemperatureasfunctionofCO2 = TemperatureasfunctionofCO2_convexNonCO2
 
 
 
@@ -69,32 +89,47 @@ elif modelNum in [3, 3.1]:
 ## Mitigation cost functions
 
 def expfct(CO2, a, b):
-    value = a * np.exp(-b*CO2) - a*np.exp(-5.5*b)
+    # math.exp gives a Python float, which does not promote
+    # single precision CO2 values to double precision
+    value = a * np.exp(-b*CO2) - a*math.exp(-5.5*b)
     return np.where(CO2 < 5.5, value, 0)
 
+#fMaxParams = (14.9766, 0.541945)
+#fMaxParams = (19.1522, 0.513221)
+fMaxParams = (10.1636, 0.540518)
+
+#fMinParams = (0.886887, 3.47027)
+#fMinParams = (1.33805, 2.38528)
+fMinParams = (1.60182, 2.10714)
+
 def fMax(CO2):
-    #return expfct(CO2, 14.9766, 0.541945)
-    #return expfct(CO2, 19.1522, 0.513221)
-    return expfct(CO2, 10.1636, 0.540518)
+    return expfct(CO2, *fMaxParams)
 
 def fMin(CO2):
-    #return expfct(CO2, 0.886887, 3.47027)
-    #return expfct(CO2, 1.33805, 2.38528)
-    return expfct(CO2, 1.60182, 2.10714)
+    return expfct(CO2, *fMinParams)
+
+
+# Cost as (linear) interpolation between fMin and fMax
+
+def f_interpolated(CO2, p):
+    safe_CO2 = np.maximum(-3, CO2)
+    return fMin(safe_CO2) + (fMax(safe_CO2) - fMin(safe_CO2)) * p
+
+# Log-linear costs, with a normally distributed error eps
+
+def f_logLinear(CO2, eps):
+    a = -0.784016
+    b = 0.777523
+    safe_CO2 = np.maximum(-3, CO2)
+    value = np.exp(a * safe_CO2 + b + eps)-0.05
+    return np.where(CO2 < 5.5, value, 0)
 
 
 if modelNum == 5:
-    def f(CO2, eps):
-       a = -0.784016
-       b = 0.777523
-       safe_CO2 = np.maximum(-3, CO2)
-       value = np.exp(a * safe_CO2 + b + eps)-0.05
-       return np.where(CO2 < 5.5, value, 0)
+    f = f_logLinear
 
 else:
-    def f(CO2, p):
-        safe_CO2 = np.maximum(-3, CO2)
-        return fMin(safe_CO2) + (fMax(safe_CO2) - fMin(safe_CO2)) * p
+    f = f_interpolated
 
 
 # Translate indexed costs to USD
@@ -109,10 +144,11 @@ def toRealCosts(indexedCosts):
 #######
 ####### These functions take as input a chosen (deterministic) parameter
 ####### and a matrix of parameter values drawn from their respective 
-####### distributions
+####### distributions. By default, the variant selected by modelNum is
+####### used; other variants can be passed as keyword arguments.
 
 
-def modelCarbonBudget(T, paramvalues):
+def modelCarbonBudget(T, paramvalues, CO2asfunctionofTemperature=CO2asfunctionofTemperature):
     TCRE = paramvalues[:,0]
     T2010 = paramvalues[:,1]
     sigma_nonCO2 = paramvalues[:,2]
@@ -132,9 +168,109 @@ def sampleCO2value (T, N, distributions, CO2asfunctionofTemperature=CO2asfunctio
     return CO2values
 
 
-def modelCosts(T, paramvalues):
+def modelCosts(T, paramvalues, CO2asfunctionofTemperature=CO2asfunctionofTemperature, f=f):
     TCRE = paramvalues[:,0]
     T2010 = paramvalues[:,1]
     sigma_nonCO2 = paramvalues[:,2]
     p = paramvalues[:,3]
     return f(CO2asfunctionofTemperature(T, TCRE, T2010, sigma_nonCO2), p)
+
+
+
+
+####### Fused evaluation of the cost model
+####### ----------------------------------
+#######
+####### modelCosts creates many temporary arrays per call (safe_CO2, and
+####### fMin and fMax twice, each with several exponentials and a where).
+####### FusedModelCosts computes the same values with in-place ufuncs in
+####### scratch buffers that are kept between calls, and computes every
+####### shared subexpression only once.
+
+
+class FusedModelCosts:
+    """
+    Drop-in replacement for modelCosts(T, paramvalues), for the cost function
+    f_interpolated. The carbon budget is fused as well for the pink plume and
+    linear non-CO2 variants; for other variants CO2asfunctionofTemperature
+    is simply called.
+    
+    The scratch buffers are reallocated only when the shape or precision of
+    the input changes. Every call returns a new output array, unless an
+    array is passed as out.
+    """
+    
+    def __init__ (self, CO2asfunctionofTemperature=CO2asfunctionofTemperature, f=f):
+        if f is not f_interpolated:
+            raise ValueError('FusedModelCosts only supports the cost function f_interpolated')
+        
+        self.CO2asfunctionofTemperature = CO2asfunctionofTemperature
+        
+        # Offset added to TCRE in the denominator of the carbon budget
+        if CO2asfunctionofTemperature is CO2asfunctionofTemperature_pinkPlume:
+            self.TCREoffset = 0.0
+        elif CO2asfunctionofTemperature is CO2asfunctionofTemperature_linearNonCO2:
+            self.TCREoffset = TCRE_nonCO2
+        else:
+            self.TCREoffset = None
+        
+        self.buffers = {}
+    
+    def __getstate__ (self):
+        # Buffers are not sent to other processes
+        state = dict(self.__dict__)
+        state['buffers'] = {}
+        return state
+    
+    def buffer (self, name, shape, dtype):
+        array = self.buffers.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self.buffers[name] = np.empty(shape, dtype)
+        return array
+    
+    def __call__ (self, T, paramvalues, out=None):
+        TCRE = paramvalues[:,0]
+        T2010 = paramvalues[:,1]
+        sigma_nonCO2 = paramvalues[:,2]
+        p = paramvalues[:,3]
+        
+        shape = np.broadcast_shapes(np.shape(T), np.shape(TCRE))
+        dtype = np.result_type(TCRE, T2010, sigma_nonCO2, p)
+        
+        CO2 = self.buffer('CO2', shape, dtype)
+        below = self.buffer('below', shape, bool)
+        costMax = self.buffer('costMax', shape, dtype)
+        costMin = self.buffer('costMin', shape, dtype)
+        
+        if self.TCREoffset is None:
+            CO2[...] = self.CO2asfunctionofTemperature(T, TCRE, T2010, sigma_nonCO2)
+        else:
+            denominator = self.buffer('denominator', np.shape(TCRE), dtype)
+            np.add(TCRE, self.TCREoffset, out=denominator)
+            np.maximum(denominator, 0.001, out=denominator)
+            
+            np.subtract(T, T2010, out=CO2)
+            np.subtract(CO2, sigma_nonCO2, out=CO2)
+            np.divide(CO2, denominator, out=CO2)
+        
+        # Costs are zero above 5.5 TtCO2. Since the cut-off lies above
+        # the lower bound of safe_CO2, it can be taken after clipping
+        np.less(CO2, 5.5, out=below)
+        np.maximum(CO2, -3, out=CO2)
+        
+        # a * exp(-b*CO2) - a * exp(-5.5*b), for fMax and fMin
+        for cost, (a, b) in ((costMax, fMaxParams), (costMin, fMinParams)):
+            np.multiply(CO2, -b, out=cost)
+            np.exp(cost, out=cost)
+            np.subtract(cost, np.exp(-5.5*b), out=cost)
+            np.multiply(cost, a, out=cost)
+        
+        # fMin + (fMax - fMin) * p, set to zero above the cut-off
+        if out is None:
+            out = np.empty(shape, dtype)
+        np.subtract(costMax, costMin, out=costMax)
+        np.multiply(costMax, p, out=costMax)
+        np.add(costMax, costMin, out=out)
+        np.multiply(out, below, out=out)
+        
+        return out
@@ -0,0 +1,82 @@
+###################
+##
+## Reproducible parallel execution
+##
+## Every task gets its own np.random.Generator, spawned from
+## a single root SeedSequence. The random numbers of a task therefore
+## only depend on the root seed and on the position of the task in
+## the task list, and not on the worker (or number of workers)
+## that happens to run it.
+##
+###################
+
+import numpy as np
+import multiprocessing
+
+
+def _runTask (job):
+    function, task, seedSequence, index = job
+    return index, function(task, np.random.default_rng(seedSequence))
+
+
+def runTasks (function, tasks, seed=None, numWorkers=None, callback=None, skip=(), ordered=True, keys=None):
+    """
+    Calls function(task, rng) for every task, with rng an independent
+    np.random.Generator per task, and returns the results in the order
+    of the tasks. The results are bit-identical for any numWorkers.
+
+    function: must be picklable, i.e. defined at module level
+    seed: root seed. If None, fresh entropy is used (the results are then
+          still independent between tasks, but not reproducible)
+    numWorkers: number of worker processes. None uses all cores, 1 runs
+                the tasks serially in the current process
+    callback: optional function called with every result as soon as it,
+              and all results before it, are available (e.g. to update
+              a progress bar)
+    skip: tasks that should not be run (e.g. because they were completed
+          in an earlier session). The other tasks keep the random stream
+          they would have had without skipping. The result of a skipped
+          task is None, and the callback is not called for it.
+    ordered: if False, the callback is called as soon as a task finishes,
+             in the order in which they finish, such that one slow task
+             does not hold up the others (e.g. writing them to a store)
+    keys: optional function giving a tuple of non-negative integers per
+          task. The random stream of a task is then determined by its key
+          instead of by its position in the task list, such that it
+          does not change when tasks are added or reordered.
+    """
+    if keys is None:
+        seedSequences = np.random.SeedSequence(seed).spawn(len(tasks))
+    else:
+        entropy = np.random.SeedSequence(seed).entropy
+        seedSequences = [np.random.SeedSequence(entropy, spawn_key=tuple(keys(task))) for task in tasks]
+
+    jobs = [
+        (function, task, seedSequence, index)
+        for index, (task, seedSequence) in enumerate(zip(tasks, seedSequences)) if task not in skip
+    ]
+
+    results = [None] * len(tasks)
+
+    if numWorkers == 1:
+        for job in jobs:
+            index, result = _runTask(job)
+            results[index] = result
+            if callback is not None:
+                callback(result)
+    else:
+        pool = multiprocessing.Pool(numWorkers)
+        try:
+            # Tasks are handed out one at a time, so that idle workers
+            # immediately pick up the next task
+            mapping = pool.imap if ordered else pool.imap_unordered
+            for index, result in mapping(_runTask, jobs, chunksize=1):
+                results[index] = result
+                if callback is not None:
+                    callback(result)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Skipped tasks remain None
+    return results
@@ -7,41 +7,29 @@ import plotly.tools as pyt
 import datetime
 import numpy as np
 
+from variancedecomposition.indexarray import IndexArray, orderNames
+
 
 
 ####### First process results obtained from sobol method to a more readable format
 
 def processResults (results):
-    allFirstOrders = []
-    allSecondOrders = []
-    allThirdOrders = []
+    """
+    Mean of every index term over the repeated runs, clipped at zero, as
+    one array of shape (number of temperatures, number of terms) per
+    order. results is an indexarray.IndexArray, or nested lists
+    results[Ti][run] of testSensitivity outputs.
+    """
+    if not isinstance(results, IndexArray):
+        results = IndexArray.fromNested(results)
     
-    # For every temperature value:
-    for Ti in range(len(results)):
-        res = results[Ti]
-        
-        firstOrders = []
-        secondOrders = []
-        thirdOrders = []
-        
-        # For every repeated sampling
-        for j in range(len(res)):
-            firstOrders += [res[j][0]]
-            secondOrders += [res[j][1]]
-            thirdOrders += [res[j][2]]
-        
-        #print(firstOrders)
-        
-        # Average all variance estimators
-        allFirstOrders += [np.mean(firstOrders,0)]
-        allSecondOrders += [np.mean(secondOrders,0)]
-        allThirdOrders += [np.mean(thirdOrders,0)]
+    means = np.maximum(0, results.mean())
     
-    return (
-        np.maximum(0,np.array(allFirstOrders)),
-        np.maximum(0,np.array(allSecondOrders)),
-        np.maximum(0,np.array(allThirdOrders))
-    )
+    # Always the first, second and third order terms, then the total
+    # effects if they were computed
+    orders = orderNames[:3] + (['total'] if np.any(results.orders == 'total') else [])
+    
+    return tuple(means[:, results.orders == order] for order in orders)
 
 
 
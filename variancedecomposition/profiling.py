@@ -0,0 +1,114 @@
+###################
+##
+## Per-phase instrumentation of the Sobol estimation
+##
+## sobol.testSensitivity (and the functions it calls) accept an
+## optional profiler. For every phase (sampling, building the sample
+## matrices, model evaluation, estimators) it then records the wall
+## time, the peak memory allocated during the phase and the number of
+## bytes the phase processed. Without a profiler nothing is recorded.
+##
+###################
+
+import time
+import tracemalloc
+import contextlib
+import numpy as np
+
+
+class PhaseProfiler:
+    """
+    records: list of dicts, one per phase, with keys phase, seconds,
+             peakBytes, bytes, and the labels (e.g. T and run).
+    labels: dict added to every new record. A driver can set these
+            before every call, e.g. profiler.labels = dict(run=3)
+    trackMemory: measure the peak memory with tracemalloc. This slows
+                 down allocations, so it can be switched off when only
+                 the timings are needed.
+    """
+
+    def __init__ (self, trackMemory=True, **labels):
+        self.records = []
+        self.labels = labels
+        self.trackMemory = trackMemory
+
+    @contextlib.contextmanager
+    def phase (self, name, nbytes=0, **labels):
+        if self.trackMemory:
+            startedTracing = not tracemalloc.is_tracing()
+            if startedTracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+
+            peakBytes = np.nan
+            if self.trackMemory:
+                peakBytes = tracemalloc.get_traced_memory()[1] - baseline
+                if startedTracing:
+                    tracemalloc.stop()
+
+            self.record(name, seconds, nbytes, peakBytes, **labels)
+
+    def record (self, name, seconds, nbytes=0, peakBytes=np.nan, overlapped=False, **labels):
+        # Adds a phase that was timed elsewhere, e.g. in a worker thread,
+        # where tracemalloc cannot attribute the memory to the phase.
+        # Overlapped phases ran concurrently with the other phases, and
+        # are not part of the wall time (see summary).
+        self.records.append(dict(
+            self.labels,
+            phase=name, seconds=seconds, peakBytes=peakBytes, bytes=nbytes, overlapped=overlapped,
+            **labels
+        ))
+
+
+def phase (profiler, name, nbytes=0, **labels):
+    # Context manager of one phase, which does nothing without a profiler
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name, nbytes, **labels)
+
+
+def summary (records):
+    """
+    Aggregates records (of one or more profilers) per phase: number of
+    calls, total and mean time, share of the total time, largest peak
+    memory and total number of bytes processed.
+    
+    The total time is the sum of the phases that did not overlap with
+    others, i.e. the wall time. The time of an overlapped phase (e.g.
+    sampling in worker threads) is not part of it; its share is the time
+    it would have added without overlap, relative to the wall time.
+    """
+    totalSeconds = sum(record['seconds'] for record in records if not record.get('overlapped', False))
+
+    phases = {}
+    for record in records:
+        phases.setdefault(record['phase'], []).append(record)
+
+    return {
+        name: dict(
+            calls = len(group),
+            seconds = sum(record['seconds'] for record in group),
+            meanSeconds = np.mean([record['seconds'] for record in group]),
+            share = sum(record['seconds'] for record in group) / totalSeconds if totalSeconds > 0 else np.nan,
+            peakBytes = max(record['peakBytes'] for record in group),
+            bytes = sum(record['bytes'] for record in group),
+            overlapped = any(record.get('overlapped', False) for record in group)
+        )
+        for name, group in phases.items()
+    }
+
+
+def printSummary (records):
+    print('%-14s %8s %12s %8s %14s %14s' % ('phase', 'calls', 'seconds', 'share', 'peak MB', 'processed MB'))
+    for name, values in summary(records).items():
+        print('%-14s %8i %12.3f %7.1f%% %14.1f %14.1f%s' % (
+            name, values['calls'], values['seconds'], 100 * values['share'], values['peakBytes'] / 1e6, values['bytes'] / 1e6,
+            '  (overlapped)' if values['overlapped'] else ''
+        ))
@@ -0,0 +1,277 @@
+###################
+##
+## Configuration-driven batch runner
+##
+## Runs a full sweep from a JSON configuration instead of editing
+## modelNum in model.py and the constants of the driver scripts:
+##
+##   python -m variancedecomposition config.json
+##
+## The configuration is expanded into one task per (variant,
+## temperature, run) block, which are scheduled on a process pool:
+## idle workers pick up the next block, and every finished block is
+## stored immediately in the ResultStore of its variant, so that an
+## interrupted sweep resumes where it stopped. At the end, the mean
+## index values per temperature are written as JSON next to the
+## stores. Plotting is left to plot.py: this module never imports
+## plotly, and runs headless.
+##
+## Example configuration (all keys are optional, see defaults):
+##
+##   {
+##     "variants": ["pinkPlume", "grayPlumeConvex"],
+##     "quantity": "costs",
+##     "temperatures": {"start": 1.5, "stop": 5, "num": 50},
+##     "N": 1000000,
+##     "runs": 50,
+##     "secondOrderIndices": "all",
+##     "thirdOrderIndices": [0, 1, 2],
+##     "totalEffects": true,
+##     "seed": 20180101,
+##     "workers": null,
+##     "output": "results"
+##   }
+##
+###################
+
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import functools
+import numpy as np
+
+import variancedecomposition.sobol as sobol
+import variancedecomposition.store as store
+import variancedecomposition.parallel as parallel
+import variancedecomposition.variants as variants
+from variancedecomposition.indexarray import IndexArray
+
+
+defaults = dict(
+    variants = None,                # Names in variants.variants, None for all
+    quantity = 'costs',             # 'costs' or 'carbonBudget'
+    temperatures = dict(start=1.5, stop=5, num=50), # List, or arguments of np.linspace
+    N = 1000000,
+    runs = 50,                      # Identical runs per temperature
+    secondOrderIndices = 'all',     # [] with the givenData estimator
+    thirdOrderIndices = False,
+    totalEffects = False,
+    sampling = 'random',            # 'random', 'sobol' or 'halton'
+    estimator = 'pickFreeze',       # 'pickFreeze' or 'givenData'
+    seed = 20180101,
+    workers = None,                 # None uses all cores
+    output = 'results'              # Directory of the result stores
+)
+
+# Names of the parameters of the cost model. The carbon budget model
+# has the first three.
+parameterNames = ['TCRE', 'T2010', 'sigma_nonCO2', 'p']
+
+
+def loadConfig (path):
+    with open(path) as infile:
+        config = json.load(infile)
+
+    unknown = set(config) - set(defaults)
+    if unknown:
+        raise ValueError('Unknown configuration keys: ' + ', '.join(sorted(unknown)))
+
+    # The given-data estimator only gives first order indices
+    if config.get('estimator') == 'givenData':
+        config.setdefault('secondOrderIndices', [])
+
+    config = dict(defaults, **config)
+    checkConfig(config)
+    return config
+
+
+def checkConfig (config):
+    # Fails before any store is opened, instead of in every worker
+    if config['quantity'] not in ('costs', 'carbonBudget'):
+        raise ValueError("quantity must be 'costs' or 'carbonBudget'")
+    if config['sampling'] not in ('random', 'sobol', 'halton'):
+        raise ValueError("sampling must be 'random', 'sobol' or 'halton'")
+    if config['estimator'] not in ('pickFreeze', 'givenData'):
+        raise ValueError("estimator must be 'pickFreeze' or 'givenData'")
+    if config['estimator'] == 'givenData' and (config['secondOrderIndices'] or config['thirdOrderIndices'] or config['totalEffects']):
+        raise ValueError('The givenData estimator only gives first order indices: secondOrderIndices must be [], thirdOrderIndices and totalEffects false')
+
+
+def temperatureGrid (config):
+    temperatures = config['temperatures']
+    if isinstance(temperatures, dict):
+        return np.linspace(temperatures['start'], temperatures['stop'], temperatures['num'])
+    return np.array(temperatures, dtype=np.float64)
+
+
+def variantNames (config):
+    names = list(variants.variants) if config['variants'] is None else config['variants']
+    for name in names:
+        variants.getVariant(name) # Fails early on unknown names
+    return names
+
+
+def modelOf (variant, quantity):
+    # Model function and distributions of the requested quantity
+    if quantity == 'costs':
+        return variant.modelCosts, variant.distributionsCosts
+    return variant.modelCarbonBudget, variant.distributionsCarbonBudget
+
+
+def samplingPlan (config, variant):
+    model, distributions = modelOf(variant, config['quantity'])
+    return sobol.SamplingPlan(len(distributions), config['secondOrderIndices'], config['thirdOrderIndices'], config['totalEffects'])
+
+
+def openStore (config, variant, Tvalues):
+    # Result store of one variant. Its manifest holds every setting the
+    # stored blocks depend on, such that a changed configuration is not
+    # mixed with earlier results.
+    return store.ResultStore(os.path.join(config['output'], '%s-%s' % (variant.name, config['quantity'])), dict(
+        variant = variant.name,
+        quantity = config['quantity'],
+        modelNum = variant.modelNum,
+        N = config['N'],
+        seed = config['seed'],
+        sampling = config['sampling'],
+        estimator = config['estimator'],
+        Tvalues = Tvalues,
+        numRuns = config['runs'],
+        secondOrderIndices = config['secondOrderIndices'],
+        thirdOrderIndices = config['thirdOrderIndices'],
+        layout = samplingPlan(config, variant).layout
+    ))
+
+
+def taskKey (task):
+    # Random stream of a block, independent of the other variants in the
+    # configuration (see parallel.runTasks)
+    name, Ti, run = task
+    return (zlib.crc32(name.encode()), Ti, run)
+
+
+def runBlock (config, Tvalues, task, rng):
+    # Indices of one (variant, temperature, run) block
+    name, Ti, run = task
+    model, distributions = modelOf(variants.getVariant(name), config['quantity'])
+    indices = sobol.testSensitivity(
+        config['N'], Tvalues[Ti], distributions, model,
+        config['secondOrderIndices'], config['thirdOrderIndices'],
+        sampling=config['sampling'], rng=rng, totalEffects=config['totalEffects'],
+        estimator=config['estimator']
+    )
+    return task, indices
+
+
+class Progress:
+    """
+    Prints the number of finished tasks, the rate and the estimated
+    remaining time on one line, at most every interval seconds. Nothing
+    is printed if file is None.
+    """
+
+    def __init__ (self, total, initial=0, interval=1.0, file=sys.stderr):
+        self.total = total
+        self.initial = initial
+        self.done = initial
+        self.interval = interval
+        self.file = file
+        self.start = time.perf_counter()
+        self.printed = -np.inf
+
+    def update (self):
+        self.done += 1
+        if self.file is None:
+            return
+        now = time.perf_counter()
+        if now - self.printed >= self.interval or self.done == self.total:
+            self.printed = now
+            rate = (self.done - self.initial) / max(now - self.start, 1e-9)
+            remaining = (self.total - self.done) / rate if rate > 0 else np.inf
+            print('\r%i/%i tasks (%.0f%%), %.2f tasks/s, %s remaining   ' % (
+                self.done, self.total, 100 * self.done / max(1, self.total), rate, formatSeconds(remaining)
+            ), end='', file=self.file, flush=True)
+
+    def close (self):
+        if self.file is not None:
+            print(file=self.file, flush=True)
+
+
+def formatSeconds (seconds):
+    if not np.isfinite(seconds):
+        return '?'
+    hours, seconds = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '%i:%02i:%02i' % (hours, minutes, seconds)
+
+
+def summarize (config, variant, Tvalues, results):
+    # Mean (over the runs) of every index term per temperature, as JSON
+    plan = samplingPlan(config, variant)
+    sensitivity = IndexArray.fromPlan(results.load(), Tvalues, plan, parameterNames[:plan.k])
+    return dict(
+        variant = variant.name,
+        quantity = config['quantity'],
+        Tvalues = Tvalues.tolist(),
+        names = sensitivity.names,
+        mean = sensitivity.mean().tolist(),
+        other = sensitivity.other().tolist(),
+        completedRuns = np.sum(np.all(np.isfinite(sensitivity.values), -1), 1).tolist()
+    )
+
+
+def runSweep (config, progress=True):
+    """
+    Runs (or resumes) every (variant, temperature, run) block of config,
+    and writes a summary per variant to the output directory. Returns
+    the result stores by variant name.
+    """
+    checkConfig(config)
+    Tvalues = temperatureGrid(config)
+    names = variantNames(config)
+    os.makedirs(config['output'], exist_ok=True)
+
+    stores = {name: openStore(config, variants.getVariant(name), Tvalues) for name in names}
+
+    tasks = [(name, Ti, run) for name in names for Ti in range(len(Tvalues)) for run in range(config['runs'])]
+    done = {(name, Ti, run) for name, results in stores.items() for Ti, run in results.completed()}
+
+    bar = Progress(len(tasks), len(done), file=sys.stderr if progress else None)
+
+    def update (result):
+        (name, Ti, run), indices = result
+        stores[name].append(Ti, run, indices)
+        bar.update()
+
+    parallel.runTasks(
+        functools.partial(runBlock, config, Tvalues), tasks, seed=config['seed'],
+        numWorkers=config['workers'], callback=update, skip=done, ordered=False, keys=taskKey
+    )
+    bar.close()
+
+    for name, results in stores.items():
+        summary = summarize(config, variants.getVariant(name), Tvalues, results)
+        with open(os.path.join(config['output'], '%s-%s-summary.json' % (name, config['quantity'])), 'w') as outfile:
+            json.dump(summary, outfile, indent=1)
+
+    return stores
+
+
+def main (arguments=None):
+    parser = argparse.ArgumentParser(description='Run a sensitivity sweep over model variants and temperatures from a JSON configuration')
+    parser.add_argument('config', help='JSON configuration file (see variancedecomposition/runner.py)')
+    parser.add_argument('--workers', type=int, help='Number of worker processes, overrides the configuration')
+    parser.add_argument('--output', help='Output directory, overrides the configuration')
+    parser.add_argument('--quiet', action='store_true', help='Do not report progress')
+    arguments = parser.parse_args(arguments)
+
+    config = loadConfig(arguments.config)
+    if arguments.workers is not None:
+        config['workers'] = arguments.workers
+    if arguments.output is not None:
+        config['output'] = arguments.output
+
+    runSweep(config, progress=not arguments.quiet)
@@ -0,0 +1,94 @@
+###################
+##
+## Shared, memory-mapped parameter samples
+##
+## Every pool worker normally draws its own 2N samples of every
+## distribution in createSampleMatrices. A SampleStore instead draws
+## every sample column once, writes it to a .npy file and hands out
+## read-only memory maps of it. All workers (and later sessions) that
+## need the same column read the same pages of the operating system's
+## file cache: the resident memory no longer grows with the number of
+## workers, and the inverse CDFs are evaluated only once.
+##
+## A column is keyed by the description of its distribution (see
+## cache.describe), its position, the seed, N, the sampling method, the
+## precision and the sampler backend. Every column has its own random
+## stream, spawned from the seed, so a column can be reused by every
+## temperature and by every model variant with the same distribution in
+## the same position. With 'sobol' or 'halton' sampling, the columns are
+## dimensions of one sequence, so the number of parameters is part of the
+## key as well. Like the keys of the cache, the description of a
+## distribution covers its code and parameters, but not the runtime state
+## of its module (e.g. the inverse CDF tables), so repeated calls reuse
+## the same columns.
+##
+## Like the cache, columns are written to a temporary file first and
+## then renamed, so workers never read a partially written column.
+##
+###################
+
+import os
+import tempfile
+import numpy as np
+
+import variancedecomposition.sobol as sobol
+import variancedecomposition.cache as cache
+import variancedecomposition.distributions as distributionsModule
+
+
+class SampleStore:
+    """
+    directory: directory of the sample files, created if necessary.
+               Columns are never removed automatically: at 8 bytes per
+               value, every column takes 16 N bytes.
+    """
+
+    def __init__ (self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path (self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def samples (self, N, distributions, seed, sampling='random', dtype=np.float64):
+        """
+        2N samples of every distribution, as read-only memory maps: the
+        first N for matrix A, the last N for matrix B (as drawSamples).
+        They can be passed to sobol.testSensitivity(..., samples=...).
+
+        seed: integer or sequence of integers, e.g. (rootSeed, run) to give
+              every run of a sweep its own samples
+        """
+        k = len(distributions)
+        columns = []
+
+        for i, dist in enumerate(distributions):
+            key = cache.cacheKey(
+                'samples', dist, i, seed, N, sampling, k if sampling != 'random' else None,
+                np.dtype(dtype).str, distributionsModule.samplerBackend
+            )
+            if not os.path.exists(self.path(key)):
+                self.put(key, drawColumn(N, distributions, i, seed, sampling).astype(dtype, copy=False))
+            columns.append(np.load(self.path(key), mmap_mode='r'))
+
+        return columns
+
+    def put (self, key, column):
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as outfile:
+            np.save(outfile, column)
+        os.replace(temporary, self.path(key))
+
+
+def drawColumn (N, distributions, i, seed, sampling='random'):
+    # 2N samples of distribution i, from its own random stream
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(i,)))
+    dist = distributions[i]
+
+    if sampling == 'random':
+        return dist(2*N, rng=rng)
+
+    # Dimensions i (matrix A) and k + i (matrix B) of one sequence
+    k = len(distributions)
+    unif = sobol.lowDiscrepancy(N, 2*k, sampling, np.random.default_rng(seed))
+    return np.concatenate([dist(N, unif=unif[:,i]), dist(N, unif=unif[:,k+i])])
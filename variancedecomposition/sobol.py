@@ -5,88 +5,322 @@
 ##
 ###################
 
+import time
+import warnings
+import itertools
+import collections
+import concurrent.futures
 import numpy as np
+import scipy.stats as stats
+import scipy.stats.qmc as qmc
+
+from variancedecomposition.profiling import phase
 
 ####### Create the sample matrices
 ## These are the matrices A and B, 
 ## and matrix created as combination between A and B
 ## by keeping certain columns (parameters) fixed
+##
+## The combined matrices are never copied: a SampleMatrix only
+## holds references to the columns of A and B it consists of
 
 
-def createSampleMatrices (N, T, distributions, model, secondOrder, thirdOrder):
+class SampleMatrix:
     """
-    T: temperature level between 0 and 5
+    Column-wise view of an N x k parameter matrix. Indexing as
+    matrix[:,i] (which is what the model functions do) returns the
+    stored column i itself, so no N x k array is ever materialised.
     """
     
-    k = len(distributions)
+    def __init__ (self, columns):
+        self.columns = columns
     
-    samples = [dist(2*N) for dist in distributions]
+    def __getitem__ (self, key):
+        rows, column = key
+        return self.columns[column][rows]
     
-    A = np.transpose(np.array([sample[:N] for sample in samples]))
-    B = np.transpose(np.array([sample[N:] for sample in samples]))
+    def __len__ (self):
+        return len(self.columns[0])
     
-    C = [None]*k
-    for i in range(k):
-        C[i] = np.copy(B)
-        C[i][:,i] = A[:,i]
+    @property
+    def shape (self):
+        return (len(self.columns[0]), len(self.columns))
+    
+    def __array__ (self, dtype=None, copy=None):
+        return np.transpose(np.array(self.columns, dtype=dtype))
+
+
+def hybridMatrix (A, B, columnsFromA):
+    # Matrix B, with the columns in columnsFromA taken from matrix A
+    return SampleMatrix([
+        A.columns[i] if i in columnsFromA else B.columns[i]
+        for i in range(len(B.columns))
+    ])
+
+
+def drawSamples (N, distributions, sampling='random', rng=None, dtype=np.float64, start=0):
+    """
+    Draws 2N values of every parameter: the first N for matrix A,
+    the last N for matrix B.
     
-    # Create a second order matrix
-    D = [None]*len(secondOrder)
-    for i in range(len(secondOrder)):
-        D[i] = np.copy(B)
-        D[i][:,secondOrder[i][0]] = A[:,secondOrder[i][0]];
-        D[i][:,secondOrder[i][1]] = A[:,secondOrder[i][1]];
+    sampling: 'random' draws (pseudo-)random numbers in each distribution,
+              'sobol' or 'halton' use a scrambled low-discrepancy sequence of
+              dimension 2k instead: its first k dimensions are transformed to
+              the columns of A, the last k to the columns of B, using the
+              inverse CDF of every distribution. For 'sobol', N should
+              preferably be a power of 2.
+    rng: np.random.Generator to draw from, instead of the global
+         numpy random state
+    dtype: precision of the returned samples. Every sample is converted
+           as soon as it is drawn.
+    start: with 'sobol' or 'halton', the index of the first point in the
+           sequence (see lowDiscrepancy)
+    """
+    if sampling == 'random':
+        return [dist(2*N, rng=rng).astype(dtype, copy=False) for dist in distributions]
     
-    # And a third order matrix
-    if thirdOrder is not False:
-        E = np.copy(B)
-        E[:,thirdOrder[0]] = A[:,thirdOrder[0]];
-        E[:,thirdOrder[1]] = A[:,thirdOrder[1]];
-        E[:,thirdOrder[2]] = A[:,thirdOrder[2]];
+    k = len(distributions)
+    unif = lowDiscrepancy(N, 2*k, sampling, rng, start)
+    
+    return [
+        np.concatenate([dist(N, unif=unif[:,i]), dist(N, unif=unif[:,k+i])]).astype(dtype, copy=False)
+        for i, dist in enumerate(distributions)
+    ]
+
 
-        yE = model(T, E)
+def lowDiscrepancy (N, dimension, sampling, rng=None, start=0):
+    # N points of a scrambled 'sobol' or 'halton' sequence in the unit
+    # hypercube of the given dimension, starting at point start. The
+    # scrambling is drawn from rng, so generators in the same state give
+    # consecutive blocks of one sequence (see sequenceGenerators)
+    
+    # Seed of the scrambling
+    seed = np.random.randint(2**31) if rng is None else rng.integers(2**31)
+    
+    if sampling == 'sobol':
+        sequence = qmc.Sobol(dimension, scramble=True, seed=seed)
+    elif sampling == 'halton':
+        sequence = qmc.Halton(dimension, scramble=True, seed=seed)
     else:
-        E = []
-        yE = np.array([0])
+        raise ValueError('Unknown sampling method: ' + str(sampling))
+    
+    if start > 0:
+        sequence.fast_forward(start)
+    return sequence.random(N)
+
+
+####### Sampling plan
+## A Sobol index of a set of parameters follows from the closed variances
+## of that set and of all its subsets (Moebius inversion). The closed
+## variance of a set S can be estimated from any two model outputs whose
+## sample matrices have exactly the columns in S in common. Besides A, B
+## and the matrices C_i (B with column i from A) needed for the first
+## order indices, the plan either adds one matrix per missing closed set,
+## or first adds the k complementary matrices (A with column i from B):
+## C_i and complementary matrix j have columns i and j in common, which
+## gives all pairs at k extra model evaluations instead of k(k-1)/2.
+
+
+class SamplingPlan:
+    """
+    k: number of parameters
+    secondOrderIndices: list of parameter pairs, or 'all' for every pair
+    thirdOrderIndices: one parameter triple, a list of triples, 'all'
+                       for every triple, or False for none
+    totalEffects: also estimate the total effect index of every parameter
     
-    yA = model(T, A)
-    yB = model(T, B)
+    fromA: for every sample matrix to evaluate, the set of columns taken
+           from matrix A (the others are taken from B). The first two
+           are A and B themselves.
+    closedSets: every set of parameters of which the closed variance is
+                needed, and pairs the indices (in fromA) of the two model
+                outputs it is estimated from.
+    terms: all index terms, first order terms first, then the second and
+           third order terms.
+    """
     
-    yC = [model(T, C[i]) for i in range(k)]
+    def __init__ (self, k, secondOrderIndices, thirdOrderIndices, totalEffects=False):
+        self.k = k
+        self.secondOrder = orderTerms(k, 2, secondOrderIndices)
+        self.thirdOrder = orderTerms(k, 3, thirdOrderIndices)
+        self.terms = [(i,) for i in range(k)] + self.secondOrder + self.thirdOrder
+        self.totalEffects = totalEffects
+        
+        allColumns = frozenset(range(k))
+        
+        # The total effect of parameter i is one minus the closed variance of
+        # all other parameters. B and C_i only differ in column i, so this is
+        # available without extra model evaluations (Jansen estimator)
+        complementSets = [allColumns - {i} for i in range(k)] if totalEffects else []
+        
+        self.closedSets = sorted(
+            {frozenset(subset) for term in self.terms for subset in subsets(term)}.union(complementSets),
+            key=lambda subset: (len(subset), sorted(subset))
+        )
+        
+        base = [allColumns, frozenset()] + [frozenset((i,)) for i in range(k)]
+        complements = [allColumns - {i} for i in range(k)]
+        
+        # Use the complementary matrices only if that saves evaluations
+        self.fromA, pairs = min(
+            coverClosedSets(base, self.closedSets, k),
+            coverClosedSets(base + complements, self.closedSets, k),
+            key=lambda cover: len(cover[0])
+        )
+        self.pairs = [pairs[subset] for subset in self.closedSets]
+        
+        # Every term as a signed sum of closed variances
+        position = {subset: i for i, subset in enumerate(self.closedSets)}
+        self.inversion = [
+            [(position[frozenset(subset)], (-1)**(len(term) - len(subset))) for subset in subsets(term)]
+            for term in self.terms
+        ]
+        self.complements = [position[subset] for subset in complementSets]
     
-    yD = [model(T, D[i]) for i in range(len(secondOrder))]
+    @property
+    def numEvaluations (self):
+        return len(self.fromA)
     
-    del(A, B, C, D, E)
+    @property
+    def layout (self):
+        # Number of terms of every order returned by testSensitivity
+        return [self.k, len(self.secondOrder), len(self.thirdOrder)] + ([self.k] if self.totalEffects else [])
+
+
+def orderTerms (k, order, indices):
+    # The requested terms of one order as a list of tuples
+    if indices is False:
+        return []
+    if isinstance(indices, str):
+        if indices != 'all':
+            raise ValueError('Unknown index terms: ' + indices)
+        return list(itertools.combinations(range(k), order))
+    if len(indices) == 0:
+        return []
+    if np.ndim(indices) == 1:
+        # A single term
+        return [tuple(indices)]
+    return [tuple(term) for term in indices]
+
+
+def subsets (term):
+    # All non-empty subsets of a term
+    return [subset for size in range(1, len(term) + 1) for subset in itertools.combinations(term, size)]
+
+
+def coverClosedSets (fromA, closedSets, k):
+    """
+    Finds a pair of sample matrices for every closed set, adding a matrix
+    (paired with A) for every set that no pair of the given matrices
+    provides. Two matrices have the columns in common that both or
+    neither take from A.
     
-    return (yA, yB, yC, yD, yE)
+    Returns the list of matrices and a dict from closed set to pair.
+    """
+    allColumns = frozenset(range(k))
+    fromA = list(fromA)
+    
+    # A with itself gives the total variance
+    available = {allColumns: (0, 0)}
+    for x, y in itertools.combinations(range(len(fromA)), 2):
+        available.setdefault(allColumns - (fromA[x] ^ fromA[y]), (x, y))
+    
+    for subset in closedSets:
+        if subset not in available:
+            fromA.append(subset)
+            for x in range(len(fromA) - 1):
+                available.setdefault(allColumns - (fromA[x] ^ subset), (x, len(fromA) - 1))
+    
+    return fromA, {subset: available[subset] for subset in closedSets}
 
 
+def temperatureLabel (T):
+    # Profiling label of a run: the temperature, unless T is a grid
+    return dict(T=float(T)) if np.ndim(T) == 0 else {}
 
-####### Create the variance estimators
-## Either the nth-order estimator or the total variance
 
-def nthOrderEstimators (yA, yB, yC_set, calctotal = False):
-    # yA and yB are the resulting model values calculating
-    # using two fully resampled parameter values
-    #
-    # yC_set are the model values using parameter values
-    # from matrix B, with a chosen set of columns taken from
-    # matrix A.
-    N = len(yA)
+def createSampleMatrices (N, T, distributions, model, plan, sampling='random', rng=None, dtype=np.float64, profiler=None, samples=None):
+    """
+    plan: SamplingPlan listing the sample matrices to evaluate. Returns the
+          model output of every matrix in plan.fromA, in the same order
+          (so yA and yB first).
+    T: temperature level between 0 and 5, or an array of temperature levels.
+       In the latter case the samples are drawn only once and the model is
+       broadcast over a leading temperature axis, so that every model output
+       has shape (len(T), N) instead of (N,).
+    sampling: 'random', 'sobol' or 'halton' (see drawSamples)
+    rng: optional np.random.Generator (see drawSamples)
+    dtype: precision of the samples and model evaluations. With np.float32,
+           memory use and memory traffic are halved; the estimators still
+           accumulate their sums in double precision.
+    profiler: optional profiling.PhaseProfiler, which records the sampling
+              (unless samples are given), matrices and model phases
+    samples: optional precomputed 2N samples of every distribution, in the
+             layout of drawSamples (e.g. the memory maps of a
+             samplestore.SampleStore). They are used without copying if
+             they already have the given dtype, and sampling and rng are
+             then ignored.
+    """
     
-    f0square = np.mean(yA)**2
+    k = len(distributions)
     
-    VY = np.sum(yA * yA) / N - f0square
+    T = temperatureAxis(T, dtype)
     
-    # Estimation of S_i
-    firstorder = (np.sum(yA * yC_set) / N - f0square) / VY
+    # Bytes of one parameter column, and of one model output
+    columnBytes = N * np.dtype(dtype).itemsize
+    outputBytes = columnBytes * max(1, np.size(T))
     
-    # Estimation of S_Ti
-    if calctotal:
-        totaleffect = 1 - (np.sum(yB * yC_set) / N - f0square) / VY
-        return (firstorder, totaleffect)
+    if samples is None:
+        with phase(profiler, 'sampling', 2 * k * columnBytes, **temperatureLabel(T)):
+            samples = drawSamples(N, distributions, sampling, rng, dtype)
+    elif len(samples) != k or any(len(sample) != 2*N for sample in samples):
+        raise ValueError('Expected 2N = %i samples of each of the %i distributions' % (2*N, k))
     else:
-        return firstorder
+        # Drawn elsewhere (and profiled there, if at all): only converted
+        samples = [np.asarray(sample).astype(dtype, copy=False) for sample in samples]
+    
+    with phase(profiler, 'matrices', 0, **temperatureLabel(T)):
+        # The first N values of every sample form matrix A, the last N matrix B
+        A = SampleMatrix([sample[:N] for sample in samples])
+        B = SampleMatrix([sample[N:] for sample in samples])
+        
+        matrices = [hybridMatrix(A, B, columns) for columns in plan.fromA]
+    
+    with phase(profiler, 'model', len(matrices) * (k * columnBytes + outputBytes), **temperatureLabel(T)):
+        outputs = [model(T, matrix) for matrix in matrices]
+    
+    del(A, B, matrices, samples)
+    
+    return outputs
+
+
+def temperatureAxis (T, dtype=np.float64):
+    # A scalar temperature is passed on unchanged. An array of temperatures
+    # becomes a column vector, such that the model functions broadcast it
+    # against the sampled parameter columns of length N. Both are converted
+    # to dtype (a scalar type, np.dtype or name such as 'float32'), such
+    # that they do not promote the model to another precision
+    if np.ndim(T) == 0:
+        return np.dtype(dtype).type(T)
+    return np.reshape(T, (-1, 1)).astype(dtype)
+
+
+
+####### Create the variance estimators
+## Closed variances of the sets of the sampling plan (Jansen estimators)
+
+def closedEstimators (plan, outputs):
+    # Relative closed variance of every closed set of the plan. Two model
+    # outputs yX and yY that share the parameters in a set S satisfy
+    # E[(yX - yY)^2] / 2 = V - V_S (Jansen), which is used for all sets
+    # alike such that the estimation errors largely cancel when the lower
+    # order terms are subtracted.
+    VY = np.var(outputs[0], -1, dtype=np.float64)
+    
+    return [
+        1 - np.mean((outputs[x] - outputs[y])**2, -1, dtype=np.float64) / (2 * VY)
+        for x, y in plan.pairs
+    ]
 
 
 
@@ -94,24 +328,445 @@ def nthOrderEstimators (yA, yB, yC_set, calctotal = False):
 ####### Combine the creation of parameter values and the calculation
 ####### of sensitivity 
 
-def testSensitivity (N, T, distributions, model, secondOrderIndices, thirdOrderIndices):
+def testSensitivity (N, T, distributions, model, secondOrderIndices, thirdOrderIndices, sampling='random', bootstrap=0, confidenceLevel=0.95, rng=None, dtype=np.float64, profiler=None, totalEffects=False, estimator='pickFreeze', samples=None):
+    """
+    secondOrderIndices: list of parameter pairs, or 'all'
+    thirdOrderIndices: parameter triple, list of triples, 'all' or False
+                       (see SamplingPlan)
+    totalEffects: also return the total effect index of every parameter,
+                  which needs no extra model evaluations. Combined with no
+                  second and third order terms, this is a cheap screening
+                  of the interactions of every parameter.
+    T: temperature level, or an array of temperature levels (grid mode).
+    sampling: 'random' for plain Monte Carlo, or 'sobol'/'halton' for
+              randomised quasi-Monte Carlo sampling (see drawSamples).
+    bootstrap: if larger than zero, also return bootstrap confidence
+               intervals based on this number of resamples (see
+               bootstrapIntervals). The result is then a tuple
+               (indices, intervals).
+    rng: np.random.Generator used for all random numbers. By default
+         the global numpy random state is used.
+    dtype: np.float32 to sample and evaluate the model in single precision
+           (see createSampleMatrices and precisionCheck)
+    profiler: optional profiling.PhaseProfiler, which records the time,
+              peak memory and bytes processed of every phase
+    estimator: 'pickFreeze' for the estimators from the sample matrices of
+               a SamplingPlan, or 'givenData' to estimate only the first
+               order indices from a single sample matrix of N model
+               evaluations (see givenDataSensitivity). secondOrderIndices
+               and thirdOrderIndices must then be empty or False, and
+               totalEffects and bootstrap are not available.
+    samples: optional precomputed parameter samples for the pick-freeze
+             estimators, e.g. from a samplestore.SampleStore (see
+             createSampleMatrices)
+    
+    Returns [firstOrders, secondOrders, thirdOrders], followed by
+    totalEffects if requested.
+    
+    In grid mode the parameter samples and sample matrices are created only
+    once and shared by all temperatures (common random numbers). The first,
+    second and third order terms are then returned as arrays of shape
+    (len(T), number of terms) instead of lists of scalars. Note that every
+    model output then holds len(T) * N values, so N may have to be lowered
+    for large temperature grids.
+    """
+    plan = SamplingPlan(len(distributions), secondOrderIndices, thirdOrderIndices, totalEffects)
+    
+    if estimator == 'givenData':
+        if plan.secondOrder or plan.thirdOrder or totalEffects or bootstrap > 0:
+            raise ValueError('The given-data estimator only gives first order indices')
+        return givenDataSensitivity(N, T, distributions, model, sampling, rng, dtype, profiler)
+    elif estimator != 'pickFreeze':
+        raise ValueError('Unknown estimator: ' + str(estimator))
+    
     # Create model values using parameter distributions
-    yA, yB, yC, yD, yE = createSampleMatrices(N, T, distributions, model, secondOrderIndices, thirdOrderIndices)
+    outputs = createSampleMatrices(N, T, distributions, model, plan, sampling, rng, dtype, profiler, samples)
+    
+    # All model outputs are read once by the estimators
+    outputBytes = sum(y.nbytes for y in outputs)
+    
+    with phase(profiler, 'estimators', outputBytes, **temperatureLabel(T)):
+        indices = estimateOrders(T, plan, outputs)
+    
+    if bootstrap > 0:
+        with phase(profiler, 'bootstrap', bootstrap * outputBytes, **temperatureLabel(T)):
+            intervals = bootstrapIntervals(T, plan, outputs, bootstrap, confidenceLevel, rng)
+        del(outputs)
+        return (indices, intervals)
+    
+    del(outputs)
+    return indices
+
+
+def estimateOrders (T, plan, outputs):
+    return combineOrders(T, plan, closedEstimators(plan, outputs))
+
+
+def bootstrapIntervals (T, plan, outputs, numBootstrap=100, confidenceLevel=0.95, rng=None):
+    """
+    Percentile bootstrap confidence intervals for every first, second and
+    third order term (and total effect), computed by resampling the rows of
+    the existing model outputs (no new model evaluations are needed).
+    
+    Returns one array per order, of shape (number of terms, 2) with the
+    lower and upper bound, or (len(T), number of terms, 2) in grid mode.
+    """
+    N = np.shape(outputs[0])[-1]
+    
+    estimates = []
+    for b in range(numBootstrap):
+        rows = np.random.randint(0, N, N) if rng is None else rng.integers(0, N, N)
+        resampled = [y[..., rows] for y in outputs]
+        estimates.append(estimateOrders(T, plan, resampled))
+        del(resampled)
+    
+    percentiles = [50 * (1 - confidenceLevel), 50 * (1 + confidenceLevel)]
+    
+    intervals = []
+    for order in range(len(estimates[0])):
+        # Bootstrap estimates along the first axis
+        values = np.array([estimate[order] for estimate in estimates])
+        intervals.append(np.moveaxis(np.percentile(values, percentiles, axis=0), 0, -1))
+    
+    return intervals
 
-    k = len(distributions)
 
-    # Calculate all first order variance terms
-    firstOrders = [nthOrderEstimators(yA, yB, yC[i]) for i in range(k)]
+def combineOrders (T, plan, closed):
+    # Subtract the closed variances of all subsets from the closed variance
+    # of every term, and arrange the result per order
+    indices = [sum(sign * closed[i] for i, sign in inversion) for inversion in plan.inversion]
+    
+    k, numSecond = plan.k, len(plan.secondOrder)
+    orders = (indices[:k], indices[k:k+numSecond], indices[k+numSecond:])
+    
+    if plan.totalEffects:
+        orders += ([1 - closed[i] for i in plan.complements],)
+    
+    if np.ndim(T) > 0:
+        # Grid mode: one row per temperature, one column per index term
+        numT = np.size(T)
+        return [np.reshape(terms, (len(terms), numT)).T for terms in orders]
+    
+    return list(orders)
 
-    # Calculate the second order variance terms defined in the input parameter secondOrderIndices
-    secondOrders = [nthOrderEstimators(yA, yB, yD[i]) - firstOrders[secondOrderIndices[i][0]] - firstOrders[secondOrderIndices[i][1]] for i in range(len(secondOrderIndices))]
 
-    # Also calculate the third order term if necessary
-    if thirdOrderIndices is not False:
-        thirdOrders = [nthOrderEstimators(yA, yB, yE) - np.sum(secondOrders) - firstOrders[0] - firstOrders[1] - firstOrders[2]]
+
+
+####### Given-data first order estimator
+## Every first order index follows from a single sample matrix of N
+## model evaluations: the samples are sorted on parameter i and divided
+## into bins of (almost) equal size, and the variance of the mean model
+## output per bin estimates the variance of E[y | x_i]. The sampling
+## noise of the bin means inflates that variance by about (bins - 1) / N
+## times the variance within the bins, which is subtracted. With the
+## default of sqrt(N) bins both this noise and the error of averaging
+## over the width of a bin vanish as N grows. Only first order indices
+## are available, for N model evaluations instead of N (k + 2).
+
+
+def givenDataSamples (N, distributions, sampling='random', rng=None, dtype=np.float64):
+    # N values of every parameter, forming a single sample matrix
+    if sampling == 'random':
+        return [dist(N, rng=rng).astype(dtype, copy=False) for dist in distributions]
+    
+    unif = lowDiscrepancy(N, len(distributions), sampling, rng)
+    return [dist(N, unif=unif[:,i]).astype(dtype, copy=False) for i, dist in enumerate(distributions)]
+
+
+def givenDataEstimators (samples, y, bins=None):
+    # First order index of every parameter from the samples and the model
+    # output y (of shape (N,), or (len(T), N) in grid mode)
+    N = np.shape(y)[-1]
+    bins = bins or int(round(np.sqrt(N)))
+    
+    starts = (np.arange(bins) * N) // bins
+    counts = np.diff(np.append(starts, N))
+    
+    y = np.asarray(y, dtype=np.float64)
+    variance = np.var(y, -1)
+    mean = np.mean(y, -1, keepdims=True)
+    
+    indices = []
+    for sample in samples:
+        means = np.add.reduceat(y[..., np.argsort(sample, kind='stable')], starts, -1) / counts
+        between = np.sum(counts * (means - mean)**2, -1) / N
+        within = variance - between
+        indices.append((between - (bins - 1) / (N - bins) * within) / variance)
+    
+    return indices
+
+
+def givenDataSensitivity (N, T, distributions, model, sampling='random', rng=None, dtype=np.float64, profiler=None, bins=None):
+    """
+    First order indices from N model evaluations (see givenDataEstimators),
+    in the layout of testSensitivity without second and third order terms.
+    
+    bins: number of bins per parameter, by default sqrt(N)
+    
+    With 'sobol' sampling, N should preferably be a power of 2.
+    """
+    plan = SamplingPlan(len(distributions), False, False)
+    
+    with phase(profiler, 'sampling', len(distributions) * N * np.dtype(dtype).itemsize, **temperatureLabel(T)):
+        samples = givenDataSamples(N, distributions, sampling, rng, dtype)
+    
+    with phase(profiler, 'model', 0, **temperatureLabel(T)):
+        y = model(temperatureAxis(T, dtype), SampleMatrix(samples))
+    
+    with phase(profiler, 'estimators', y.nbytes, **temperatureLabel(T)):
+        closed = givenDataEstimators(samples, y, bins)
+    
+    return combineOrders(T, plan, closed)
+
+
+
+
+####### Accuracy guard for single precision
+## Compares the indices in single precision with a double precision
+## reference run on exactly the same samples, such that the difference
+## is only due to the precision and not to sampling noise.
+
+
+def precisionCheck (N, T, distributions, model, secondOrderIndices, thirdOrderIndices, tolerance=1e-3, seed=0, sampling='random'):
+    """
+    Returns the largest absolute difference between any index computed in
+    single and in double precision, and warns if it exceeds tolerance.
+    """
+    single = testSensitivity(N, T, distributions, model, secondOrderIndices, thirdOrderIndices, sampling, rng=np.random.default_rng(seed), dtype=np.float32)
+    double = testSensitivity(N, T, distributions, model, secondOrderIndices, thirdOrderIndices, sampling, rng=np.random.default_rng(seed), dtype=np.float64)
+    
+    difference = max(
+        np.max(np.abs(np.subtract(single[order], double[order])), initial=0)
+        for order in range(len(double))
+    )
+    
+    if difference > tolerance:
+        warnings.warn('Single precision indices deviate %.2e from double precision (tolerance %.2e)' % (difference, tolerance))
+    
+    return difference
+
+
+
+
+####### Streaming estimation
+## Instead of keeping all N model values in memory, the samples are drawn
+## and evaluated in chunks. Every chunk is folded into running sums
+## (mean and variance of yA, and the co-moment of yA with every other
+## model output), which are merged using the pairwise update formulas
+## of Chan et al. (1979). Memory use is then bounded by the chunk size.
+
+
+class SobolAccumulator:
+    """
+    Running sums for the Sobol estimators: the mean and sum of squared
+    deviations (M2) of yA, and of the difference yX - yY of the pair of
+    model outputs of every closed set of a SamplingPlan. Works on model
+    values with a leading temperature axis as well.
+    """
+    
+    def __init__ (self, pairs):
+        self.pairs = pairs
+        self.count = 0
+        self.meanA = 0.0
+        self.M2A = 0.0
+        self.means = [0.0] * len(pairs)
+        self.M2s = [0.0] * len(pairs)
+    
+    def add (self, outputs):
+        # Sums of the new chunk, then merged into the running sums
+        chunk = SobolAccumulator(self.pairs)
+        chunk.count = np.shape(outputs[0])[-1]
+        chunk.meanA = np.mean(outputs[0], -1, dtype=np.float64)
+        chunk.M2A = np.sum((outputs[0] - chunk.meanA[..., np.newaxis])**2, -1)
+        
+        for j, (x, y) in enumerate(self.pairs):
+            difference = outputs[x] - outputs[y]
+            chunk.means[j] = np.mean(difference, -1, dtype=np.float64)
+            chunk.M2s[j] = np.sum((difference - chunk.means[j][..., np.newaxis])**2, -1)
+        
+        self.merge(chunk)
+    
+    def merge (self, other):
+        total = self.count + other.count
+        weight = self.count * other.count / total
+        
+        deltaA = other.meanA - self.meanA
+        self.M2A = self.M2A + other.M2A + deltaA**2 * weight
+        self.meanA = self.meanA + deltaA * other.count / total
+        
+        for j in range(len(self.pairs)):
+            delta = other.means[j] - self.means[j]
+            self.M2s[j] = self.M2s[j] + other.M2s[j] + delta**2 * weight
+            self.means[j] = self.means[j] + delta * other.count / total
+        
+        self.count = total
+    
+    def estimators (self):
+        # Relative closed variance of every closed set (see closedEstimators)
+        return [
+            1 - (M2 + self.count * mean**2) / (2 * self.M2A)
+            for mean, M2 in zip(self.means, self.M2s)
+        ]
+
+
+def chunkGenerators (numChunks, rng=None):
+    # An independent generator per chunk, spawned from rng, such that the
+    # samples of a chunk do not depend on when (or in which thread) the
+    # chunks are drawn
+    seed = None if rng is None else rng.integers(2**63)
+    return [np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(numChunks)]
+
+
+def sequenceGenerators (numChunks, rng=None):
+    # Generators in the same state for every chunk, such that the chunks
+    # draw the same scrambling, i.e. consecutive blocks of one
+    # low-discrepancy sequence
+    seed = None if rng is None else rng.integers(2**63)
+    seed = np.random.SeedSequence(seed).entropy
+    return [np.random.default_rng(seed) for _ in range(numChunks)]
+
+
+def timedDrawSamples (N, distributions, sampling='random', rng=None, dtype=np.float64, start=0):
+    # drawSamples and its wall time, for the worker threads of
+    # testSensitivityStreaming (tracemalloc and the phases of a profiler
+    # are not thread-safe)
+    began = time.perf_counter()
+    samples = drawSamples(N, distributions, sampling, rng, dtype, start)
+    return samples, time.perf_counter() - began
+
+
+def testSensitivityStreaming (N, T, distributions, model, secondOrderIndices, thirdOrderIndices, chunkSize=100000, sampling='random', rng=None, dtype=np.float64, profiler=None, totalEffects=False, numThreads=0):
+    """
+    Same as testSensitivity, but draws and evaluates the N samples in chunks
+    of at most chunkSize samples. A single run with a large N then fits in
+    bounded memory, and can replace many repeated runs with a small N.
+    
+    numThreads: if larger than zero, the samples of the next numThreads
+                chunks are drawn in a pool of this many threads, while the
+                current chunk is evaluated and accumulated (numpy and scipy
+                release the GIL in the samplers and the model). At most
+                numThreads + 1 chunks of samples are then in memory. The
+                results are identical to those with numThreads = 0. The
+                profiler then records the time spent drawing the samples
+                in the threads as the 'threadSampling' phase (without
+                peak memory), and the time the evaluation waited for them
+                as the 'wait' phase.
+    
+    With 'sobol' or 'halton' sampling, the chunks are consecutive blocks
+    of one scrambled sequence of N points, as without chunks. For 'sobol',
+    chunkSize is then rounded down to a power of 2, such that every chunk
+    is a balanced block of the sequence, and N should preferably be a
+    power of 2 as well.
+    """
+    plan = SamplingPlan(len(distributions), secondOrderIndices, thirdOrderIndices, totalEffects)
+    accumulator = SobolAccumulator(plan.pairs)
+    
+    if sampling == 'random':
+        generators = chunkGenerators(-(-N // chunkSize), rng)
     else:
-        thirdOrders = []
+        if sampling == 'sobol':
+            chunkSize = 2**int(np.log2(chunkSize))
+            if N > chunkSize and N & (N - 1):
+                warnings.warn("The balance properties of Sobol' points require N to be a power of 2.")
+        generators = sequenceGenerators(-(-N // chunkSize), rng)
+    
+    chunks = [(min(chunkSize, N - start), start, chunkRng) for start, chunkRng in zip(range(0, N, chunkSize), generators)]
+    columnBytes = len(distributions) * np.dtype(dtype).itemsize
+    
+    def evaluate (chunkN, samples):
+        outputs = createSampleMatrices(chunkN, T, distributions, model, plan, sampling, None, dtype, profiler, samples)
+        
+        with phase(profiler, 'estimators', sum(y.nbytes for y in outputs), **temperatureLabel(T)):
+            accumulator.add(outputs)
+    
+    if numThreads <= 0:
+        for chunkN, start, chunkRng in chunks:
+            with phase(profiler, 'sampling', 2 * chunkN * columnBytes, **temperatureLabel(T)):
+                samples = drawSamples(chunkN, distributions, sampling, chunkRng, dtype, start)
+            evaluate(chunkN, samples)
+            del(samples)
+        return combineOrders(T, plan, accumulator.estimators())
+    
+    with concurrent.futures.ThreadPoolExecutor(numThreads) as executor:
+        prepare = lambda chunk: executor.submit(timedDrawSamples, chunk[0], distributions, sampling, chunk[2], dtype, chunk[1])
+        pending = collections.deque(prepare(chunk) for chunk in chunks[:numThreads])
+        
+        for i, (chunkN, _, _) in enumerate(chunks):
+            # Time spent waiting for the samples of this chunk
+            with phase(profiler, 'wait', 0, **temperatureLabel(T)):
+                samples, seconds = pending.popleft().result()
+            
+            # The samples were drawn in a worker thread, overlapping the
+            # other phases, so the time of this phase is not part of the
+            # wall time of the run
+            if profiler is not None:
+                profiler.record('threadSampling', seconds, 2 * chunkN * columnBytes, overlapped=True, **temperatureLabel(T))
+            
+            if i + numThreads < len(chunks):
+                pending.append(prepare(chunks[i + numThreads]))
+            
+            evaluate(chunkN, samples)
+            del(samples)
+    
+    return combineOrders(T, plan, accumulator.estimators())
+
+
+
 
-    del(yA, yB, yC, yD, yE)
-    return [firstOrders, secondOrders, thirdOrders]
+####### Adaptive sample size
+## Samples are added in batches until the confidence intervals of all
+## requested indices are narrow enough, or until the sample budget is
+## used. The confidence intervals follow from the spread of the
+## estimates of the individual batches (batch means).
 
+
+def adaptiveSensitivity (T, distributions, model, secondOrderIndices, thirdOrderIndices, tolerance=0.005, batchSize=100000, maxSamples=10000000, minBatches=4, confidenceLevel=0.95, sampling='random', rng=None, dtype=np.float64, totalEffects=False):
+    """
+    Keeps adding batches of batchSize samples until the confidence half-width
+    of every first, second and third order term (and total effect, if
+    requested) is below tolerance (for every temperature in grid mode), or
+    until maxSamples samples have been used.
+    
+    Returns (indices, halfWidths, N): the indices estimated from all samples,
+    the confidence half-widths in the same layout, and the number of samples
+    that was used.
+    
+    With 'sobol' or 'halton' sampling, every batch is an independently
+    scrambled sequence (randomised quasi-Monte Carlo), such that the batch
+    means give valid confidence intervals. The error of the combined
+    estimate then decays at the rate of a single batch, not of one
+    sequence of N points (use testSensitivityStreaming for that). For
+    'sobol', batchSize should be a power of 2.
+    """
+    plan = SamplingPlan(len(distributions), secondOrderIndices, thirdOrderIndices, totalEffects)
+    
+    total = SobolAccumulator(plan.pairs)
+    batchEstimates = []
+    
+    while True:
+        outputs = createSampleMatrices(batchSize, T, distributions, model, plan, sampling, rng, dtype)
+        
+        batch = SobolAccumulator(plan.pairs)
+        batch.add(outputs)
+        total.merge(batch)
+        
+        del(outputs)
+        
+        batchEstimates.append(combineOrders(T, plan, batch.estimators()))
+        numBatches = len(batchEstimates)
+        
+        # Batch means confidence half-width of every order
+        tValue = stats.t.ppf(0.5 * (1 + confidenceLevel), max(1, numBatches - 1))
+        halfWidths = [
+            tValue * np.std([estimate[order] for estimate in batchEstimates], 0, ddof=1) / np.sqrt(numBatches)
+            if numBatches > 1 else np.full(np.shape(batchEstimates[0][order]), np.inf)
+            for order in range(len(batchEstimates[0]))
+        ]
+        
+        converged = numBatches >= minBatches and all(np.all(width < tolerance) for width in halfWidths)
+        if converged or total.count + batchSize > maxSamples:
+            break
+    
+    indices = combineOrders(T, plan, total.estimators())
+    
+    return (indices, halfWidths, total.count)
@@ -0,0 +1,107 @@
+###################
+##
+## Append-only binary result store
+##
+## Every completed (temperature, run) block of a sweep is appended
+## to a binary file as soon as it is available, so that a crashed or
+## interrupted sweep can be resumed. A small JSON manifest next to it
+## describes the sweep (model variant, N, seed, temperatures) and the
+## layout of the index values in every record.
+##
+###################
+
+import os
+import json
+import numpy as np
+
+
+def flattenIndices (indices):
+    # [firstOrders, secondOrders, thirdOrders] (and totalEffects) as
+    # returned by sobol.testSensitivity, as one vector
+    return np.concatenate([np.ravel(orders) for orders in indices])
+
+
+class ResultStore:
+    """
+    path: file name without extension. The manifest is stored in
+          path.json, the records in path.bin.
+    manifest: dict describing the sweep. It must contain 'Tvalues',
+              'numRuns' and 'layout', the number of first, second and
+              third order terms (and total effects) in every record. If
+              the store already exists, the given manifest must match the
+              stored one.
+    """
+
+    def __init__ (self, path, manifest):
+        self.manifestPath = path + '.json'
+        self.dataPath = path + '.bin'
+
+        manifest = json.loads(json.dumps(manifest, default=_toJSON))
+
+        if os.path.exists(self.manifestPath):
+            with open(self.manifestPath) as infile:
+                stored = json.load(infile)
+            if stored != manifest:
+                raise ValueError('Result store %s was created with a different manifest' % self.manifestPath)
+        else:
+            with open(self.manifestPath, 'w') as outfile:
+                json.dump(manifest, outfile, indent=1)
+
+        self.manifest = manifest
+        self.layout = manifest['layout']
+        self.recordType = np.dtype([
+            ('Ti', '<i4'),
+            ('run', '<i4'),
+            ('values', '<f8', (sum(self.layout),))
+        ])
+
+    def records (self):
+        if not os.path.exists(self.dataPath):
+            return np.zeros(0, self.recordType)
+
+        # A record that was only partially written (e.g. when the
+        # process was killed) is ignored
+        numRecords = os.path.getsize(self.dataPath) // self.recordType.itemsize
+        return np.fromfile(self.dataPath, self.recordType, count=numRecords)
+
+    def completed (self):
+        # Set of (Ti, run) blocks that are already stored
+        records = self.records()
+        return set(zip(records['Ti'].tolist(), records['run'].tolist()))
+
+    def append (self, Ti, run, indices):
+        record = np.zeros(1, self.recordType)
+        record['Ti'] = Ti
+        record['run'] = run
+        record['values'] = flattenIndices(indices)
+
+        with open(self.dataPath, 'ab') as outfile:
+            # Drop a partially written record of an earlier crash first
+            outfile.truncate(outfile.tell() - outfile.tell() % self.recordType.itemsize)
+            outfile.write(record.tobytes())
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+    def load (self):
+        """
+        All stored values as one array of shape
+        (number of temperatures, number of runs, number of index terms).
+        Blocks that were not computed yet are NaN.
+        """
+        values = np.full((len(self.manifest['Tvalues']), self.manifest['numRuns'], sum(self.layout)), np.nan)
+        records = self.records()
+        values[records['Ti'], records['run']] = records['values']
+        return values
+
+    def split (self, values):
+        # Inverse of flattenIndices: [firstOrders, secondOrders, thirdOrders, ...]
+        bounds = np.cumsum(self.layout)[:-1]
+        return np.split(values, bounds, axis=-1)
+
+
+def _toJSON (value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Cannot store %r in the manifest' % (value,))
@@ -0,0 +1,195 @@
+###################
+##
+## Polynomial chaos surrogate
+##
+## Instead of estimating the Sobol indices from N model evaluations per
+## sample matrix, the model is evaluated once on a design of a few
+## thousand points and approximated by a polynomial chaos expansion (PCE)
+## in the input distributions (Sudret, 2008). The basis polynomials are
+## orthonormal, so the variance of the model is the sum of the squared
+## coefficients, and the closed variance of a set of parameters is the
+## sum of the squared coefficients of the polynomials that only depend on
+## parameters in that set. All index terms of every order then follow as
+## in sobol.combineOrders, without further model evaluations.
+##
+## Normally distributed parameters are expanded in Hermite polynomials of
+## the standardised parameter, all others in Legendre polynomials of
+## 2u - 1, with u = CDF(x) the uniform transform of the parameter. The
+## basis is truncated hyperbolically (sparse in the interaction terms),
+## fitted by least squares, and the degree is chosen per temperature by
+## the leave-one-out cross-validation error, which is returned with the
+## indices. The cost models have kinks (see f_interpolated), where the
+## expansion converges slowly: the error shows how far to trust the
+## surrogate, and exact.py gives a reference for the linear variants.
+##
+###################
+
+import itertools
+import numpy as np
+import scipy.stats as stats
+from scipy.special import factorial
+
+import variancedecomposition.distributions as distributions
+import variancedecomposition.sobol as sobol
+from variancedecomposition.profiling import phase
+
+
+def polynomialFamily (distribution):
+    # Hermite polynomials for normal distributions, Legendre polynomials
+    # of the uniform transform for all others
+    if getattr(distribution, 'func', None) is distributions.sample_normal:
+        return 'hermite'
+    return 'legendre'
+
+
+def designPoints (N, k, sampling='sobol', rng=None):
+    # N points in the unit hypercube of dimension k
+    if sampling == 'random':
+        return np.random.random((N, k)) if rng is None else rng.random((N, k))
+    return sobol.lowDiscrepancy(N, k, sampling, rng)
+
+
+def germ (family, unif):
+    # Standardised variable of the polynomials: standard normal for
+    # 'hermite', uniform on [-1, 1] for 'legendre'
+    if family == 'hermite':
+        return stats.norm.ppf(unif)
+    return 2 * unif - 1
+
+
+def univariatePolynomials (family, xi, degree):
+    """
+    Orthonormal polynomials of degree 0 up to degree in xi, as an array
+    of shape (degree + 1, len(xi)), from the three-term recurrences of
+    the (probabilists') Hermite and the Legendre polynomials.
+    """
+    values = np.ones((degree + 1, len(xi)))
+    if degree > 0:
+        values[1] = xi
+    for n in range(1, degree):
+        if family == 'hermite':
+            values[n+1] = xi * values[n] - n * values[n-1]
+        else:
+            values[n+1] = ((2*n + 1) * xi * values[n] - n * values[n-1]) / (n + 1)
+
+    n = np.arange(degree + 1)[:, np.newaxis]
+    if family == 'hermite':
+        return values / np.sqrt(factorial(n))
+    return values * np.sqrt(2*n + 1)
+
+
+def multiIndices (k, degree, q=0.75):
+    """
+    Degrees of the k parameters of every basis polynomial, such that the
+    hyperbolic norm (sum alpha_i^q)^(1/q) is at most degree. With q = 1
+    this is the full total degree basis; a smaller q drops most of the
+    high degree interaction terms. The constant polynomial comes first.
+    """
+    alphas = [
+        alpha for alpha in itertools.product(range(degree + 1), repeat=k)
+        if np.sum(np.power(alpha, q))**(1/q) <= degree + 1e-9
+    ]
+    return np.array(sorted(alphas, key=lambda alpha: (sum(alpha), alpha[::-1])), dtype=int)
+
+
+def basisMatrix (polynomials, alphas):
+    # Value of every basis polynomial (columns) at every design point (rows),
+    # given the univariate polynomials of every parameter
+    Psi = np.ones((polynomials[0].shape[1], len(alphas)))
+    for i, values in enumerate(polynomials):
+        Psi *= values[alphas[:, i]].T
+    return Psi
+
+
+def fitExpansion (Psi, y):
+    """
+    Least squares coefficients of the basis Psi (N x P) for the outputs y
+    (N x number of temperatures), and the relative leave-one-out error
+    of every column of y. The leave-one-out residuals follow from the
+    diagonal of the hat matrix, without refitting.
+    """
+    Q, R = np.linalg.qr(Psi)
+    coefficients = np.linalg.solve(R, Q.T @ y)
+
+    leverage = np.sum(Q**2, 1)[:, np.newaxis]
+    residuals = (y - Psi @ coefficients) / (1 - leverage)
+
+    variance = np.var(y, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        errors = np.where(variance > 0, np.mean(residuals**2, 0) / variance, 0.0)
+
+    return coefficients, errors
+
+
+def closedVariances (alphas, coefficients, closedSets):
+    # Closed variance of every set relative to the variance of the
+    # expansion, for every column of the coefficients
+    active = alphas > 0
+    squares = coefficients[1:]**2
+    total = np.sum(squares, 0)
+
+    closed = []
+    for subset in closedSets:
+        outside = [i for i in range(alphas.shape[1]) if i not in subset]
+        inSubset = ~np.any(active[1:][:, outside], 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            closed.append(np.where(total > 0, np.sum(squares[inSubset], 0) / total, 0.0))
+    return closed
+
+
+def surrogateSensitivity (N, T, distributions, model, secondOrderIndices, thirdOrderIndices,
+                          degrees=range(1, 9), q=0.75, sampling='sobol', rng=None,
+                          totalEffects=False, profiler=None):
+    """
+    First, second and third order indices (and total effects) from a
+    polynomial chaos expansion of model, fitted on N model evaluations.
+    Returns (indices, errors): indices in the same layout as
+    sobol.testSensitivity (also in grid mode when T is an array), and the
+    relative leave-one-out error of the expansion at every temperature.
+
+    degrees: candidate maximum degrees of the expansion. Per temperature,
+             the one with the smallest leave-one-out error is used.
+             Degrees whose basis has more than N / 2 polynomials are
+             skipped, as their least squares fit is not well determined.
+    q: norm of the hyperbolic truncation, between 0 and 1
+    sampling: 'sobol', 'halton' or 'random' design points. For 'sobol',
+              N should preferably be a power of 2.
+    """
+    k = len(distributions)
+    plan = sobol.SamplingPlan(k, secondOrderIndices, thirdOrderIndices, totalEffects)
+    families = [polynomialFamily(dist) for dist in distributions]
+
+    with phase(profiler, 'sampling', **sobol.temperatureLabel(T)):
+        unif = designPoints(N, k, sampling, rng)
+        samples = sobol.SampleMatrix([dist(N, unif=unif[:,i]) for i, dist in enumerate(distributions)])
+
+    with phase(profiler, 'model', **sobol.temperatureLabel(T)):
+        y = np.reshape(model(sobol.temperatureAxis(T), samples), (-1, N)).T
+
+    with phase(profiler, 'fit', **sobol.temperatureLabel(T)):
+        candidates = [
+            alphas for alphas in (multiIndices(k, degree, q) for degree in degrees)
+            if len(alphas) <= N / 2
+        ]
+        if len(candidates) == 0:
+            raise ValueError('N = %i is too small for any of the candidate degrees' % N)
+
+        maxDegree = max(np.max(alphas) for alphas in candidates)
+        polynomials = [
+            univariatePolynomials(family, germ(family, unif[:,i]), maxDegree)
+            for i, family in enumerate(families)
+        ]
+
+        errors = np.full(y.shape[1], np.inf)
+        closed = [np.zeros(y.shape[1]) for subset in plan.closedSets]
+        for alphas in candidates:
+            coefficients, candidateErrors = fitExpansion(basisMatrix(polynomials, alphas), y)
+            better = candidateErrors < errors
+            errors[better] = candidateErrors[better]
+            for current, values in zip(closed, closedVariances(alphas, coefficients, plan.closedSets)):
+                current[better] = values[better]
+
+    if np.ndim(T) == 0:
+        return sobol.combineOrders(T, plan, [value[0] for value in closed]), errors[0]
+
+    return sobol.combineOrders(T, plan, closed), errors
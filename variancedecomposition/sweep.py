@@ -0,0 +1,127 @@
+###################
+##
+## Adaptive temperature grid
+##
+## Instead of a fixed grid of temperatures, the sweep starts with a
+## coarse uniform grid and then repeatedly bisects the temperature
+## intervals where the index vectors at the two ends differ by more
+## than a tolerance, until no interval does or the point budget is
+## used. Most index curves are flat, so the points end up in the narrow
+## regions where they change quickly (e.g. where the costs cut off at
+## CO2 = 5.5), giving sharper curves for fewer model evaluations than a
+## uniform grid.
+##
+## The Monte Carlo noise of the indices also makes neighbouring points
+## differ, so the tolerance should be well above the noise of the
+## (run-averaged) indices. The exact or surrogate engines have no such
+## noise.
+##
+###################
+
+import numpy as np
+
+import variancedecomposition.sobol as sobol
+import variancedecomposition.parallel as parallel
+import variancedecomposition.store as store
+
+
+class SensitivityTask:
+    """
+    Picklable function (T, rng) -> sobol.testSensitivity(N, T, distributions,
+    model, secondOrderIndices, thirdOrderIndices, rng=rng, **options), as
+    used by adaptiveSweep. options are the other keyword arguments of
+    testSensitivity, e.g. totalEffects or sampling.
+    """
+
+    def __init__ (self, N, distributions, model, secondOrderIndices, thirdOrderIndices, **options):
+        self.N = N
+        self.distributions = distributions
+        self.model = model
+        self.secondOrderIndices = secondOrderIndices
+        self.thirdOrderIndices = thirdOrderIndices
+        self.options = options
+
+    def __call__ (self, T, rng):
+        return sobol.testSensitivity(
+            self.N, T, self.distributions, self.model,
+            self.secondOrderIndices, self.thirdOrderIndices, rng=rng, **self.options
+        )
+
+
+def _runTask (task, rng):
+    # A task is (sensitivity, T, run): returns the index vector
+    sensitivity, T, run = task
+    return store.flattenIndices(sensitivity(T, rng))
+
+
+def refinements (Tvalues, means, tolerance, minSpacing, budget):
+    """
+    Midpoints of the intervals between neighbouring temperatures where the
+    largest difference of the (mean) index vectors exceeds tolerance, and
+    that are wider than 2 minSpacing. If there are more than budget, the
+    intervals with the largest differences are bisected first.
+    """
+    differences = np.nanmax(np.abs(np.diff(means, axis=0)), 1)
+    widths = np.diff(Tvalues)
+
+    candidates = np.nonzero((differences > tolerance) & (widths >= 2 * minSpacing))[0]
+    candidates = candidates[np.argsort(-differences[candidates], kind='stable')][:budget]
+
+    return np.sort(Tvalues[candidates] + 0.5 * widths[candidates])
+
+
+def adaptiveSweep (sensitivity, Tmin, Tmax, tolerance=0.02, numInitial=9, maxPoints=50, numRuns=1, minSpacing=None, seed=None, numWorkers=None, callback=None):
+    """
+    sensitivity: picklable function (T, rng) returning the indices at a
+                 single temperature in the layout of sobol.testSensitivity,
+                 e.g. a SensitivityTask
+    Tmin, Tmax: temperature range. The sweep starts with numInitial
+                equally spaced temperatures, including both ends.
+    tolerance: an interval is bisected if any index term differs by more
+               than this between its two ends (averaged over the runs)
+    maxPoints: maximum total number of temperatures
+    numRuns: number of identical runs per temperature
+    minSpacing: intervals are not bisected below this width, by default
+                (Tmax - Tmin) / 256
+    seed: root seed. Every round of bisections gets its own independent
+          random streams derived from it (see parallel.runTasks)
+    numWorkers, callback: see parallel.runTasks. The callback is called
+                          with (T, run, indexVector) of every task.
+
+    Returns (Tvalues, values): the sorted temperatures, and an array of
+    shape (len(Tvalues), numRuns, number of index terms) as accepted by
+    indexarray.IndexArray.
+    """
+    if minSpacing is None:
+        minSpacing = (Tmax - Tmin) / 256
+
+    rootSeed = np.random.SeedSequence(seed).entropy
+
+    Tvalues = np.zeros(0)
+    values = None
+    newT = np.linspace(Tmin, Tmax, min(numInitial, maxPoints))
+    roundNumber = 0
+
+    while len(newT) > 0:
+        tasks = [(sensitivity, T, run) for T in newT for run in range(numRuns)]
+        taskIterator = iter(tasks)
+
+        def update (result):
+            # Results arrive in the order of the tasks
+            _, T, run = next(taskIterator)
+            if callback is not None:
+                callback(T, run, result)
+
+        results = parallel.runTasks(_runTask, tasks, seed=[rootSeed, roundNumber], numWorkers=numWorkers, callback=update)
+        newValues = np.reshape(results, (len(newT), numRuns, -1))
+
+        # Merge the new temperatures into the sorted grid
+        Tvalues = np.concatenate([Tvalues, newT])
+        values = newValues if values is None else np.concatenate([values, newValues])
+        order = np.argsort(Tvalues, kind='stable')
+        Tvalues, values = Tvalues[order], values[order]
+
+        roundNumber += 1
+        newT = refinements(Tvalues, np.nanmean(values, 1), tolerance, minSpacing, maxPoints - len(Tvalues))
+
+    return Tvalues, values
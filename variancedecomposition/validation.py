@@ -0,0 +1,227 @@
+###################
+##
+## Validation of the estimators against known indices
+##
+## Every check runs an estimator on a case with known Sobol indices and
+## returns the largest absolute error over all index terms, which must
+## stay below the tolerance of the check. The tolerances are a few times
+## the Monte Carlo error observed at the given sample sizes, such that
+## the checks pass for any seed, but fail on a real bias. Run all checks
+## with
+##
+##   python -m variancedecomposition.validation
+##
+## which exits with a non-zero status if any check fails. The last
+## checks are consistency checks of the caches, whose error is the
+## number of unexpected entries.
+##
+###################
+
+import os
+import sys
+import argparse
+import tempfile
+import numpy as np
+
+import variancedecomposition.sobol as sobol
+import variancedecomposition.model as model
+import variancedecomposition.exact as exact
+import variancedecomposition.variants as variants
+import variancedecomposition.distributions as distributionsModule
+import variancedecomposition.cache as cache
+import variancedecomposition.samplestore as samplestore
+
+
+def modelOf (variant, costs):
+    if costs:
+        return variant.distributionsCosts, variant.modelCosts
+    return variant.distributionsCarbonBudget, variant.modelCarbonBudget
+
+
+def maxError (estimate, reference):
+    # Largest absolute difference over all orders and terms
+    return max(np.max(np.abs(np.subtract(a, b)), initial=0) for a, b in zip(estimate, reference))
+
+
+def exactComparison (variantName, costs=True, N=2**19, temperatures=(1.5, 2.5, 3.5), seed=0):
+    """
+    Largest difference between testSensitivity (all first, second and
+    third order terms and total effects, scrambled Sobol sampling) and
+    exact.exactSensitivity.
+    """
+    variant = variants.getVariant(variantName)
+    distributions, function = modelOf(variant, costs)
+    T = np.array(temperatures)
+
+    reference = exact.exactSensitivity(T, variant, 'all', 'all', totalEffects=True, costs=costs)
+    estimate = sobol.testSensitivity(
+        N, T, distributions, function, 'all', 'all',
+        sampling='sobol', totalEffects=True, rng=np.random.default_rng(seed)
+    )
+    return maxError(estimate, reference)
+
+
+def fusedComparison (variantName, N=100000, temperatures=(1.0, 2.5, 4.0, 5.0), seed=0):
+    """
+    Largest difference between model.FusedModelCosts and modelCosts of a
+    variant, relative to the largest cost, for a scalar temperature and
+    for a temperature grid
+    """
+    variant = variants.getVariant(variantName)
+    fused = variant.fusedModelCosts()
+    rng = np.random.default_rng(seed)
+    samples = sobol.SampleMatrix([dist(N, rng=rng) for dist in variant.distributionsCosts])
+
+    error = 0.0
+    for T in [temperatures[0], sobol.temperatureAxis(np.array(temperatures))]:
+        reference = variant.modelCosts(T, samples)
+        error = max(error, np.max(np.abs(fused(T, samples) - reference)) / np.max(np.abs(reference)))
+    return error
+
+
+def givenDataComparison (variantName, N, costs=True, temperatures=(1.5, 2.5, 3.5), seed=0):
+    """
+    Largest difference between the given-data first order indices
+    (scrambled Sobol sampling) and exact.exactSensitivity. The error is
+    dominated by the binning bias, which decays as 1/sqrt(N): about
+    1.5e-2 at N=2^12, 3.9e-3 at N=2^16 and 1e-3 at N=2^20 for the costs
+    of pinkPlumePERT.
+    """
+    variant = variants.getVariant(variantName)
+    distributions, function = modelOf(variant, costs)
+    T = np.array(temperatures)
+
+    reference = exact.exactSensitivity(T, variant, [], False, costs=costs)
+    estimate = sobol.testSensitivity(
+        N, T, distributions, function, [], False,
+        sampling='sobol', estimator='givenData', rng=np.random.default_rng(seed)
+    )
+    return maxError(estimate[:1], reference[:1])
+
+
+# Sobol' g-function on four uniform inputs: the first order index of
+# input i is V_i / V, with V_i = 1 / (3 (1 + a_i)^2) and
+# V = prod(1 + V_i) - 1
+gFunctionCoefficients = np.array([0, 1, 4.5, 9])
+
+
+def sample_uniform (num, unif=None, rng=None):
+    return distributionsModule.randomSource(rng).random(num) if unif is None else unif
+
+
+def gFunction (T, X):
+    # Independent of the temperature
+    return np.prod([(np.abs(4 * X[:,i] - 2) + a) / (1 + a) for i, a in enumerate(gFunctionCoefficients)], 0)
+
+
+def gFunctionIndices ():
+    V = 1 / (3 * (1 + gFunctionCoefficients)**2)
+    return V / (np.prod(1 + V) - 1)
+
+
+def gFunctionComparison (N, seed=0):
+    """
+    Largest difference between the given-data first order indices of the
+    g-function (scrambled Sobol sampling) and the analytic indices
+    """
+    estimate = sobol.testSensitivity(
+        N, 2.5, [sample_uniform] * len(gFunctionCoefficients), gFunction, [], False,
+        sampling='sobol', estimator='givenData', rng=np.random.default_rng(seed)
+    )
+    return maxError(estimate[:1], [gFunctionIndices()])
+
+
+def tableBackend (function):
+    # Runs function with the tabulated inverse CDFs, starting without any
+    # table, and restores the sampler backend afterwards
+    backend = distributionsModule.samplerBackend
+    distributionsModule.samplerBackend = 'table'
+    distributionsModule.iCDFTables.clear()
+    try:
+        return function()
+    finally:
+        distributionsModule.samplerBackend = backend
+
+
+def cacheStability (seed=0, N=1000):
+    """
+    Number of entries that two identical EvaluationCache.sensitivity
+    calls create beyond the first. The first call builds the inverse CDF
+    tables, which must not change the key of its entry.
+    """
+    variant = variants.getVariant('pinkPlumePERT')
+
+    def run ():
+        with tempfile.TemporaryDirectory() as directory:
+            evaluations = cache.EvaluationCache(directory)
+            for _ in range(2):
+                evaluations.sensitivity(N, 2.5, variant.distributionsCosts, variant.modelCosts, [], False, seed)
+            return len([name for name in os.listdir(directory) if name.endswith('.pkl')]) - 1
+
+    return tableBackend(run)
+
+
+def sampleStoreStability (seed=0, N=1000):
+    """
+    Number of sample columns that two identical SampleStore.samples
+    calls write beyond the first ones
+    """
+    distributions = variants.getVariant('pinkPlumePERT').distributionsCosts
+
+    def run ():
+        with tempfile.TemporaryDirectory() as directory:
+            store = samplestore.SampleStore(directory)
+            for _ in range(2):
+                store.samples(N, distributions, seed)
+            return len([name for name in os.listdir(directory) if name.endswith('.npy')]) - len(distributions)
+
+    return tableBackend(run)
+
+
+def fusedVariants ():
+    # Variants with the cost function supported by FusedModelCosts
+    return [name for name, variant in variants.variants.items() if variant.f is model.f_interpolated]
+
+
+# (name, function, tolerance). The carbon budget of pinkPlume is not
+# checked: its variance is dominated by the rare samples with TCRE close
+# to zero, which the exact indices include but no feasible sample size
+# resolves.
+checks = [
+    ('exact pinkPlume costs, N=2^19', lambda seed: exactComparison('pinkPlume', True, seed=seed), 1e-3),
+    ('exact pinkPlumePERT costs, N=2^19', lambda seed: exactComparison('pinkPlumePERT', True, seed=seed), 1e-3),
+    ('exact pinkPlumePERT carbon budget, N=2^19', lambda seed: exactComparison('pinkPlumePERT', False, seed=seed), 1e-3),
+    ('given data g-function, N=2^12', lambda seed: gFunctionComparison(2**12, seed), 3e-2),
+    ('given data g-function, N=2^18', lambda seed: gFunctionComparison(2**18, seed), 4e-3),
+    ('given data pinkPlumePERT costs, N=2^12', lambda seed: givenDataComparison('pinkPlumePERT', 2**12, seed=seed), 3e-2),
+    ('given data pinkPlumePERT costs, N=2^16', lambda seed: givenDataComparison('pinkPlumePERT', 2**16, seed=seed), 8e-3),
+    ('given data pinkPlumePERT costs, N=2^20', lambda seed: givenDataComparison('pinkPlumePERT', 2**20, seed=seed), 2e-3),
+] + [
+    ('fused costs %s' % name, lambda seed, name=name: fusedComparison(name, seed=seed), 1e-12)
+    for name in fusedVariants()
+] + [
+    ('cache key stable while inverse CDF tables are built', cacheStability, 0.5),
+    ('sample store keys stable while inverse CDF tables are built', sampleStoreStability, 0.5),
+]
+
+
+def runChecks (seed=0, log=sys.stdout):
+    # Returns True if all checks pass
+    passed = True
+    for name, function, tolerance in checks:
+        error = function(seed)
+        passed = passed and error < tolerance
+        print('%-55s max error %9.2e  tolerance %8.1e  %s' % (name, error, tolerance, 'ok' if error < tolerance else 'FAILED'), file=log)
+    return passed
+
+
+def main (arguments=None):
+    parser = argparse.ArgumentParser(description='Validate the Sobol estimators against known indices')
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args(arguments)
+
+    sys.exit(0 if runChecks(arguments.seed) else 1)
+
+
+if __name__ == '__main__':
+    main()
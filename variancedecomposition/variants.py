@@ -0,0 +1,101 @@
+###################
+##
+## Registry of model variants
+##
+## Every variant bundles the carbon budget function, the cost
+## function and the parameter distributions of one of the models
+## in the paper, such that all variants can be used in the same
+## process, selected by name at call time. The module-level
+## modelNum switch in model.py is then no longer needed.
+##
+###################
+
+from functools import partial
+
+import variancedecomposition.model as model
+import variancedecomposition.distributions as distributions
+
+
+class ModelVariant:
+    """
+    modelCarbonBudget and modelCosts have the same signature as the
+    functions in model.py, (T, paramvalues), and can be passed directly
+    to sobol.testSensitivity. They are picklable, and can therefore be
+    sent to pool workers as well.
+    """
+
+    def __init__ (self, name, modelNum, description, CO2asfunctionofTemperature, TemperatureasfunctionofCO2, f):
+        self.name = name
+        self.modelNum = modelNum
+        self.description = description
+
+        self.CO2asfunctionofTemperature = CO2asfunctionofTemperature
+        self.TemperatureasfunctionofCO2 = TemperatureasfunctionofCO2
+        self.f = f
+
+        self.distributionsCosts = distributions.distributionsCostsPerModel[modelNum]
+        self.distributionsCarbonBudget = self.distributionsCosts[:3]
+
+        self.modelCarbonBudget = partial(model.modelCarbonBudget, CO2asfunctionofTemperature=CO2asfunctionofTemperature)
+        self.modelCosts = partial(model.modelCosts, CO2asfunctionofTemperature=CO2asfunctionofTemperature, f=f)
+
+    def fusedModelCosts (self):
+        # Buffer-reusing version of modelCosts (see model.FusedModelCosts)
+        return model.FusedModelCosts(self.CO2asfunctionofTemperature, self.f)
+
+    def __repr__ (self):
+        return 'ModelVariant(%r)' % self.name
+
+
+variants = {}
+
+def register (*args):
+    variant = ModelVariant(*args)
+    variants[variant.name] = variant
+
+
+register(
+    'pinkPlume', 0,
+    'TCRE from pink plume, symmetrical distribution (#1 in paper)',
+    model.CO2asfunctionofTemperature_pinkPlume, model.TemperatureasfunctionofCO2_pinkPlume, model.f_interpolated
+)
+register(
+    'pinkPlumePERT', 1,
+    'TCRE from pink plume, asymmetrical (Beta-PERT) distribution (#2 in paper)',
+    model.CO2asfunctionofTemperature_pinkPlume, model.TemperatureasfunctionofCO2_pinkPlume, model.f_interpolated
+)
+register(
+    'grayPlumeLinear', 2,
+    'TCRE from gray plume + linear non-CO2 contributions (#3 in paper)',
+    model.CO2asfunctionofTemperature_linearNonCO2, model.TemperatureasfunctionofCO2_linearNonCO2, model.f_interpolated
+)
+register(
+    'grayPlumeConvex', 3,
+    'TCRE from gray plume + convex non-CO2 contributions (#4 in paper)',
+    model.CO2asfunctionofTemperature_convexNonCO2, model.TemperatureasfunctionofCO2_convexNonCO2, model.f_interpolated
+)
+register(
+    'grayPlumeConvexHalved', 3.1,
+    'TCRE from gray plume + convex non-CO2 contributions, with halved non-CO2 uncertainty',
+    model.CO2asfunctionofTemperature_convexNonCO2, model.TemperatureasfunctionofCO2_convexNonCO2, model.f_interpolated
+)
+register(
+    'collinsLinear', 4,
+    'TCRE from Collins et al (2013) + linear non-CO2 contributions (#5 in paper)',
+    model.CO2asfunctionofTemperature_linearNonCO2, model.TemperatureasfunctionofCO2_linearNonCO2, model.f_interpolated
+)
+register(
+    'pinkPlumeLogCost', 5,
+    'TCRE from pink plume, log-linear cost distribution',
+    model.CO2asfunctionofTemperature_pinkPlume, model.TemperatureasfunctionofCO2_pinkPlume, model.f_logLinear
+)
+
+
+def getVariant (name):
+    # Select a variant by its name, or by its (old) modelNum
+    if name in variants:
+        return variants[name]
+    for variant in variants.values():
+        if variant.modelNum == name:
+            return variant
+    raise KeyError('Unknown model variant: ' + str(name))